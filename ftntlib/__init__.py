@@ -5,3 +5,9 @@ from .fos_restapi import FortiOSREST
 from .fpcapi import fpcapi
 from .fap_restapi import FAPREST
 from .fmg_flatui_proxy_api import FmgFlatuiProxyApi
+from .session_pool import JSONSessionPool
+
+try:
+    from .fmg_jsonapi_async import FortiManagerJSONAsync
+except ImportError:  # aiohttp is an optional dependency
+    pass
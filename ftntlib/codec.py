@@ -0,0 +1,67 @@
+# coding: utf-8
+
+"""
+codec.py
+
+JSON codecs used by the clients to encode requests and decode responses.
+
+Codecs encode to bytes and decode from raw bytes (or str), so response
+bodies are decoded without building an intermediate str. orjson is used
+when it is installed, the json module otherwise:
+
+    fmg.codec("json")    # force the standard library codec
+    fmg.codec("orjson")  # force orjson (must be installed)
+    fmg.codec("auto")    # orjson when available (default)
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is an optional dependency
+    orjson = None
+
+
+class JSONCodec(object):
+    """Standard library json codec."""
+
+    name = "json"
+
+    def dumps(self, obj):
+        return json.dumps(obj).encode("utf-8")
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec(object):
+    """orjson codec."""
+
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("orjson is not installed")
+
+    def dumps(self, obj):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+CODECS = {"json": JSONCodec, "orjson": OrjsonCodec}
+
+
+def get_codec(codec=None):
+    """
+    Return a codec instance.
+
+    codec: None or "auto" for the fastest available codec, a name from
+    CODECS, or any object with dumps(obj) -> bytes and loads(bytes) methods.
+    """
+    if codec is None or codec == "auto":
+        codec = "orjson" if orjson is not None else "json"
+    if isinstance(codec, str):
+        return CODECS[codec]()
+    return codec
@@ -0,0 +1,141 @@
+# coding: utf-8
+
+"""
+compression.py
+
+HTTP compression of request bodies and response negotiation for the
+clients, with byte counters:
+
+    fmg.compression("on", threshold=1024)
+    ...
+    fmg.compression_stats()
+    {'requests': 12, 'requests_compressed': 3, 'request_bytes': 5120344,
+     'request_wire_bytes': 310988, 'responses': 12, 'response_bytes': ...,
+     'response_wire_bytes': ..., 'saved_bytes': ...}
+
+Request bodies are only compressed when the server is known to accept
+compressed requests, hence the opt-in.
+"""
+
+import threading
+import zlib
+
+ENCODINGS = ("gzip", "deflate")
+
+
+class Compression(object):
+    """
+    Compression settings and counters of a client.
+
+    encoding: "gzip" or "deflate" for the request bodies, None to only
+              negotiate compressed responses
+    threshold: minimum body size (bytes) to compress
+    level: zlib compression level (1 fastest, 9 smallest)
+    accept: Accept-Encoding sent with every request
+    """
+
+    def __init__(
+        self, encoding="gzip", threshold=1024, level=6, accept="gzip, deflate"
+    ):
+        if encoding is not None and encoding not in ENCODINGS:
+            raise ValueError("Unknown encoding {}".format(encoding))
+        self.encoding = encoding
+        self.threshold = threshold
+        self.level = level
+        self.accept = accept
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.requests_compressed = 0
+            self.request_bytes = 0
+            self.request_wire_bytes = 0
+            self.responses = 0
+            self.response_bytes = 0
+            self.response_wire_bytes = 0
+
+    def _compress(self, body):
+        if self.encoding == "gzip":
+            # wbits 16 + 15: gzip header and trailer
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        else:
+            compressor = zlib.compressobj(self.level)
+        return compressor.compress(body) + compressor.flush()
+
+    def encode(self, body, headers):
+        """
+        Return the body to send, compressed when it is big enough, and
+        update headers (Content-Encoding, Accept-Encoding).
+        """
+        if self.accept:
+            headers["Accept-Encoding"] = self.accept
+        sent = body
+        if self.encoding is not None and len(body) >= self.threshold:
+            compressed = self._compress(body)
+            if len(compressed) < len(body):
+                headers["Content-Encoding"] = self.encoding
+                sent = compressed
+        with self._lock:
+            self.requests += 1
+            self.request_bytes += len(body)
+            self.request_wire_bytes += len(sent)
+            if sent is not body:
+                self.requests_compressed += 1
+        return sent
+
+    def received(self, response):
+        """
+        Count a requests response, once its content has been read.
+        """
+        size = len(response.content)
+        wire = None
+        try:
+            # Bytes read from the socket, before decoding
+            wire = response.raw.tell()
+        except (AttributeError, ValueError):
+            pass
+        if not wire:
+            wire = int(response.headers.get("Content-Length") or size)
+        self.count(size, wire)
+
+    def count(self, size, wire):
+        """
+        Count a response of size bytes, wire bytes before decoding.
+        """
+        with self._lock:
+            self.responses += 1
+            self.response_bytes += size
+            self.response_wire_bytes += wire
+
+    def stats(self):
+        with self._lock:
+            return {
+                "encoding": self.encoding,
+                "requests": self.requests,
+                "requests_compressed": self.requests_compressed,
+                "request_bytes": self.request_bytes,
+                "request_wire_bytes": self.request_wire_bytes,
+                "responses": self.responses,
+                "response_bytes": self.response_bytes,
+                "response_wire_bytes": self.response_wire_bytes,
+                "saved_bytes": self.request_bytes
+                - self.request_wire_bytes
+                + self.response_bytes
+                - self.response_wire_bytes,
+            }
+
+
+def get_compression(current, status, **settings):
+    """
+    Return the Compression of a client for status "on" (with settings),
+    "off" or a Compression instance.
+    """
+    if status == "on":
+        return Compression(**settings)
+    if status == "off":
+        return None
+    if isinstance(status, Compression):
+        return status
+    return current
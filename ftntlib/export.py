@@ -0,0 +1,499 @@
+# coding: utf-8
+
+"""
+export.py
+
+Stream table entries (or any iterable of dicts) to NDJSON, Arrow IPC or
+Parquet files in constant memory.
+
+Arrow IPC and Parquet need pyarrow:
+
+    from ftntlib.export import export_table, export_tables
+
+    export_table(fmg, "pm/config/adom/root/obj/firewall/address",
+                 "address.parquet")
+    export_tables(fmg, {
+        "dvmdb/device": "devices.ndjson",
+        "pm/config/adom/root/pkg/default/firewall/policy": "policy.arrow",
+    }, workers=4)
+"""
+
+import concurrent.futures
+import json
+import os
+
+from .codec import get_codec
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pyarrow is an optional dependency
+    pyarrow = None
+
+# File extensions and their format
+FORMATS = {
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".json": "ndjson",
+    ".arrow": "ipc",
+    ".arrows": "ipc",
+    ".ipc": "ipc",
+    ".parquet": "parquet",
+}
+
+
+def guess_format(path):
+    extension = os.path.splitext(str(path))[1].lower()
+    if extension not in FORMATS:
+        raise ValueError("Unknown export format for {}".format(path))
+    return FORMATS[extension]
+
+
+class NDJSONWriter(object):
+    """
+    Write one JSON document per line.
+
+    path: file name or binary file object
+    codec: see codec.get_codec
+    """
+
+    def __init__(self, path, codec=None):
+        self._codec = get_codec(codec)
+        self._own = not hasattr(path, "write")
+        self._file = open(path, "wb") if self._own else path
+        self.rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def write(self, row):
+        self._file.write(self._codec.dumps(row) + b"\n")
+        self.rows += 1
+
+    def close(self):
+        if self._own:
+            self._file.close()
+        else:
+            self._file.flush()
+
+
+class ArrowWriter(object):
+    """
+    Write record batches to an Arrow IPC or a Parquet file.
+
+    path: file name (or pyarrow sink)
+    format: "ipc" (IPC streaming format, read it with pyarrow.ipc.open_stream;
+            unlike the IPC file format it allows a different dictionary in
+            each batch) or "parquet"
+    schema: pyarrow.Schema, inferred from the first infer_rows rows when
+            None (columns of mixed types or only None are strings). Columns
+            not in a given schema are dropped, columns found after the
+            infer_rows rows raise ValueError (a file has a single schema).
+            Values not matching a string column are stored as strings,
+            values not matching another column raise ValueError.
+    batch_size: rows per record batch (Parquet row group)
+    infer_rows: rows buffered to infer the schema (default batch_size)
+    nested: "json" to store lists and dicts as JSON strings (FortiManager
+            attributes are not always of the same type, e.g. a string or a
+            list of strings, which a fixed schema can't hold), "native" to
+            keep them as Arrow lists and structs
+    dictionary: columns to dictionary-encode ("all" for every string column)
+    """
+
+    def __init__(
+        self,
+        path,
+        format="parquet",
+        schema=None,
+        batch_size=10000,
+        infer_rows=None,
+        nested="json",
+        dictionary=None,
+    ):
+        if pyarrow is None:
+            raise ImportError("pyarrow is not installed")
+        if format not in ("ipc", "parquet"):
+            raise ValueError("Unknown Arrow format {}".format(format))
+        self._path = path
+        self._format = format
+        self._schema = schema
+        self._batch_size = batch_size
+        self._infer_rows = infer_rows or batch_size
+        self._nested = nested
+        self._dictionary = dictionary
+        self._writer = None
+        self._buffer = []
+        self._inferred = 0
+        self.rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    @property
+    def schema(self):
+        return self._schema
+
+    def _row(self, row):
+        if self._nested != "json":
+            return row
+        return dict(
+            (
+                key,
+                json.dumps(value) if isinstance(value, (list, dict)) else value,
+            )
+            for key, value in row.items()
+        )
+
+    def _values(self, rows, name):
+        return [row.get(name) for row in rows]
+
+    def _infer(self, rows):
+        names = []
+        known = set()
+        for row in rows:
+            for name in row:
+                if name not in known:
+                    known.add(name)
+                    names.append(name)
+        fields = []
+        for name in names:
+            try:
+                kind = pyarrow.array(self._values(rows, name)).type
+            except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+                # Mixed types in the first rows
+                kind = pyarrow.string()
+            if pyarrow.types.is_null(kind):
+                # Only None in the first rows
+                kind = pyarrow.string()
+            if self._dictionary == "all":
+                encode = True
+            else:
+                encode = name in (self._dictionary or ())
+            if encode and pyarrow.types.is_string(kind):
+                kind = pyarrow.dictionary(pyarrow.int32(), kind)
+            fields.append(pyarrow.field(name, kind))
+        return pyarrow.schema(fields)
+
+    def _check(self, rows):
+        known = set(self._schema.names)
+        extra = []
+        for row in rows:
+            if not known.issuperset(row):
+                extra.extend(name for name in row if name not in known)
+                known.update(row)
+        if extra:
+            # Dropped, so that close() still writes a valid file
+            self._buffer = []
+            raise ValueError(
+                "Columns {} found after the {} rows used to infer the schema, "
+                "give a schema or a larger infer_rows".format(
+                    ", ".join(extra), self._inferred
+                )
+            )
+
+    def _column(self, field, values):
+        try:
+            return pyarrow.array(values, type=field.type)
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+            kind = field.type
+            if pyarrow.types.is_dictionary(kind):
+                kind = kind.value_type
+            if not pyarrow.types.is_string(kind):
+                raise ValueError(
+                    "Column {} holds values which are not {}, give a schema "
+                    "with a string column".format(field.name, field.type)
+                )
+            # e.g. a column of None in the first rows holding integers later
+            values = [None if value is None else str(value) for value in values]
+            return pyarrow.array(values, type=field.type)
+
+    def _open(self):
+        if self._format == "parquet":
+            return pyarrow.parquet.ParquetWriter(self._path, self._schema)
+        return pyarrow.ipc.new_stream(self._path, self._schema)
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        if self._schema is None:
+            self._schema = self._infer(self._buffer)
+            self._inferred = len(self._buffer)
+        elif self._inferred:
+            self._check(self._buffer)
+        arrays = [
+            self._column(field, self._values(self._buffer, field.name))
+            for field in self._schema
+        ]
+        batch = pyarrow.RecordBatch.from_arrays(arrays, schema=self._schema)
+        if self._writer is None:
+            self._writer = self._open()
+        if self._format == "parquet":
+            self._writer.write_table(pyarrow.Table.from_batches([batch]))
+        else:
+            self._writer.write_batch(batch)
+        self._buffer = []
+
+    def write(self, row):
+        self._buffer.append(self._row(row))
+        self.rows += 1
+        limit = self._batch_size
+        if self._schema is None:
+            limit = max(limit, self._infer_rows)
+        if len(self._buffer) >= limit:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        if self._writer is None:
+            # No rows: write an empty file with the schema (if any)
+            if self._schema is None:
+                self._schema = pyarrow.schema([])
+            self._writer = self._open()
+        self._writer.close()
+
+
+def writer(path, format=None, **options):
+    """
+    Return a writer for path, format guessed from its extension when None.
+
+    options are given to ArrowWriter (or codec to NDJSONWriter).
+    """
+    format = format or guess_format(path)
+    if format == "ndjson":
+        return NDJSONWriter(path, options.get("codec"))
+    return ArrowWriter(path, format, **options)
+
+
+def export_rows(rows, path, format=None, **options):
+    """
+    Write the rows (dicts) to path and return the number of rows written.
+    """
+    with writer(path, format, **options) as out:
+        for row in rows:
+            out.write(row)
+    return out.rows
+
+
+def export_table(
+    fmg, url, path, format=None, page_size=1000, data=None, writer_options={}
+):
+    """
+    Export a FortiManager table to path, fetched page_size entries at a time.
+
+    data: get options (fields, filter, loadsub...)
+    writer_options: see ArrowWriter (schema, batch_size, nested...)
+
+    Return the number of rows written. Raise FortiManagerJSONError on error.
+    """
+    rows = fmg.iter_get(url, page_size, data)
+    return export_rows(rows, path, format, **writer_options)
+
+
+def export_tables(fmg, tables, workers=4, **options):
+    """
+    Export several tables concurrently.
+
+    tables: {url: path}
+    options: see export_table
+
+    Return {url: rows written}. The first error is raised once all the
+    exports are finished.
+    """
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        futures = dict(
+            (url, executor.submit(export_table, fmg, url, path, **options))
+            for url, path in tables.items()
+        )
+    return dict((url, future.result()) for url, future in futures.items())
+
+
+# FortiAnalyzer log fields with few distinct values, dictionary-encoded by
+# LogSink
+LOG_DICTIONARY_FIELDS = (
+    "action",
+    "policyid",
+    "policytype",
+    "srcintf",
+    "dstintf",
+    "srcintfrole",
+    "dstintfrole",
+    "app",
+    "appcat",
+    "apprisk",
+    "service",
+    "proto",
+    "devid",
+    "devname",
+    "vd",
+    "type",
+    "subtype",
+    "level",
+    "logid",
+    "eventtype",
+    "utmaction",
+    "trandisp",
+    "srccountry",
+    "dstcountry",
+)
+
+
+class LogSink(object):
+    """
+    Turn FortiAnalyzer log search pages into Arrow record batches and
+    rolling Parquet files.
+
+    batch_size: rows per record batch, peak memory is about one batch plus
+                one page
+    dictionary: fields to dictionary-encode (string or integer fields)
+
+    The schema of each log type is inferred from its first batch and kept
+    in schemas[logtype]. New fields are appended to it. A field whose
+    values no longer fit its type becomes a string field:
+
+        sink = LogSink()
+        pages = faz.logsearch_pages("root", "traffic", start, end)
+        files = sink.write_parquet("traffic", pages, "traffic-{index:05d}.parquet")
+    """
+
+    def __init__(self, batch_size=65536, dictionary=LOG_DICTIONARY_FIELDS):
+        if pyarrow is None:
+            raise ImportError("pyarrow is not installed")
+        self._batch_size = batch_size
+        self._dictionary = set(dictionary or ())
+        self.schemas = {}
+
+    def _type(self, name, array):
+        kind = array.type
+        if pyarrow.types.is_null(kind):
+            kind = pyarrow.string()
+        if name in self._dictionary and (
+            pyarrow.types.is_string(kind) or pyarrow.types.is_integer(kind)
+        ):
+            kind = pyarrow.dictionary(pyarrow.int32(), kind)
+        return kind
+
+    def _column(self, name, values, kind):
+        try:
+            if kind is None:
+                kind = self._type(name, pyarrow.array(values))
+            return pyarrow.array(values, type=kind)
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+            # e.g. an integer field with a "N/A" value
+            kind = pyarrow.string()
+            if name in self._dictionary:
+                kind = pyarrow.dictionary(pyarrow.int32(), kind)
+            values = [None if value is None else str(value) for value in values]
+            return pyarrow.array(values, type=kind)
+
+    def record_batch(self, logtype, rows):
+        """
+        Convert a list of rows to a RecordBatch using (and updating) the
+        schema of logtype.
+        """
+        schema = self.schemas.get(logtype)
+        names = list(schema.names) if schema is not None else []
+        known = set(names)
+        for row in rows:
+            for name in row:
+                if name not in known:
+                    known.add(name)
+                    names.append(name)
+        fields = []
+        arrays = []
+        for name in names:
+            values = []
+            for row in rows:
+                value = row.get(name)
+                if isinstance(value, (list, dict)):
+                    value = json.dumps(value)
+                values.append(value)
+            kind = None
+            if schema is not None and name in schema.names:
+                kind = schema.field(name).type
+            array = self._column(name, values, kind)
+            fields.append(pyarrow.field(name, array.type))
+            arrays.append(array)
+        self.schemas[logtype] = pyarrow.schema(fields)
+        return pyarrow.RecordBatch.from_arrays(arrays, schema=self.schemas[logtype])
+
+    def batches(self, logtype, pages):
+        """
+        Yield record batches of batch_size rows from pages (lists of rows).
+        """
+        buffer = []
+        for rows in pages:
+            buffer.extend(rows)
+            while len(buffer) >= self._batch_size:
+                yield self.record_batch(logtype, buffer[: self._batch_size])
+                buffer = buffer[self._batch_size :]
+        if buffer:
+            yield self.record_batch(logtype, buffer)
+
+    def write_parquet(self, logtype, pages, pattern, rows_per_file=1000000):
+        """
+        Write pages to Parquet files named pattern.format(logtype=logtype,
+        index=n), starting a new file before exceeding rows_per_file rows
+        (files hold whole batches) and when the schema changes. Return the
+        list of files written.
+        """
+        files = []
+        writer = None
+        rows = 0
+        try:
+            for batch in self.batches(logtype, pages):
+                if writer is not None and (
+                    rows + batch.num_rows > rows_per_file
+                    or not writer.schema.equals(batch.schema)
+                ):
+                    writer.close()
+                    writer = None
+                if writer is None:
+                    path = pattern.format(logtype=logtype, index=len(files))
+                    writer = pyarrow.parquet.ParquetWriter(path, batch.schema)
+                    files.append(path)
+                    rows = 0
+                writer.write_table(pyarrow.Table.from_batches([batch]))
+                rows += batch.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+        return files
+
+
+def export_logsearch(
+    faz,
+    pattern,
+    adom,
+    logtype,
+    start,
+    end,
+    rows_per_file=1000000,
+    batch_size=65536,
+    sink=None,
+    **search
+):
+    """
+    Run a FortiAnalyzer log search and write its rows to rolling Parquet
+    files (see LogSink.write_parquet). Return the list of files written.
+
+    search: logsearch_pages() options, or logsearch_sharded() ones when
+            window or rows_per_window is given
+    """
+    if "window" in search or "rows_per_window" in search:
+        pages = faz.logsearch_sharded(adom, logtype, start, end, **search)
+    else:
+        pages = faz.logsearch_pages(adom, logtype, start, end, **search)
+    sink = sink or LogSink(batch_size)
+    try:
+        return sink.write_parquet(logtype, pages, pattern, rows_per_file)
+    finally:
+        pages.close()
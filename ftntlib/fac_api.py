@@ -1,6 +1,8 @@
 import requests
 import json
 
+from .codec import get_codec
+
 # To avoid the SSL warning
 # Caught in https://stackoverflow.com/questions/15445981/how-do-i-disable-the-security-certificate-check-in-python-requests
 from urllib3.exceptions import InsecureRequestWarning
@@ -16,6 +18,7 @@ class fortiauthenticator:
         self._session = requests.Session()
         self._session.headers.update({'Accept': 'application/json'})
         self._debug = False
+        self._codec = get_codec()
         
     def login(self, ip, username, secret_key, version='v1'):
         self._ip = ip
@@ -30,6 +33,10 @@ class fortiauthenticator:
         else:
             self._debug = False
 
+    def codec(self, codec):
+        # 'auto', 'json', 'orjson' or a codec object, see ftntlib.codec
+        self._codec = get_codec(codec)
+
     def debug_print(self, response):
         # REQUEST
         request_method = response.request.method
@@ -57,7 +64,7 @@ class fortiauthenticator:
                 'code': response.status_code,
                 'reason': response.reason,
             },
-            'data': response.json()
+            'data': self._codec.loads(response.content)
         }
 
         return response_block
@@ -70,10 +77,13 @@ class fortiauthenticator:
 
     def patch(self, resource, params=None, data=None):
         url = f'{self._base_url}/{resource}/'
+        if data is not None:
+            data = self._codec.dumps(data)
 
         response = self._session.patch(url,
                                        params=params,
-                                       json=data,
+                                       data=data,
+                                       headers={'Content-Type': 'application/json'},
                                        verify=False)
 
         return self.generate_response(response)
@@ -30,7 +30,7 @@ class FAPREST(FortiOSREST):
     def decode_reply(self, res):
         if res.status_code in {200, 202}:
             try:
-                return res.json()
+                return self._codec.loads(res.content)
             except ValueError as err:
                 return {
                     "errors": [str(err)],
@@ -50,7 +50,10 @@ class FAPREST(FortiOSREST):
 
     def set(self, path, parameters, timeout=None):
         url = self.get_url(None, path, None, None, None)
-        res = self._session.post(url, json=parameters, timeout=timeout)
+        res = self._session.post(url,
+                                 data=self._codec.dumps(parameters),
+                                 headers={'content-type': 'application/json'},
+                                 timeout=timeout)
         self.dprint(res)
         return self.decode_reply(res)
 
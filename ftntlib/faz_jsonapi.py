@@ -11,27 +11,54 @@
 
 import time
 import logging
+import threading
+import calendar
+import datetime
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import sys
 
+from .codec import get_codec
+from .compression import get_compression
+from .hooks import JSONPrinter, first_url
+
 if sys.version_info >= (2,7):
     logging.captureWarnings(True)
 else:
     from requests.packages.urllib3.exceptions import InsecureRequestWarning
     requests.packages.urllib3.disable_warnings()
 
+# Per-call options, local to the current thread/asyncio task:
+# { client : { option : value } }
+_call_options = contextvars.ContextVar('faz_call_options', default={})
+_pending_params = contextvars.ContextVar('faz_pending_params', default={})
+
+class FortiAnalyzerJSONError (Exception):
+    '''
+    Error raised by the FortiAnalyzerJSON iterators, which cannot return a
+    status. The JSON-RPC error (or the transport exception) is in .status
+    '''
+    def __init__ (self, url, status):
+        super(FortiAnalyzerJSONError, self).__init__('{}: {}'.format(url, status))
+        self.url = url
+        self.status = status
+
 class FortiAnalyzerJSON (object):
     
     def __init__ (self):
         self._reqid = 1
+        self._reqid_lock = threading.Lock()
         self._sid = None
         self._url = None
         self._ssl_verify = False
         self._debug = False
         self._bbcode = False
         self._ws_mode = False
-        self._params = False
         self._skip = False
         self._verbose = False
         self._root = False
@@ -39,27 +66,84 @@ class FortiAnalyzerJSON (object):
         self._timeout = None
         self._apiver = 3
         self._jsonrpc = "2.0"
+        self._pool_connections = 10
+        self._pool_maxsize = 10
+        self._pool_block = False
+        self._max_retries = 0
+        self._keepalive = True
+        self._session = self._new_session()
+        self._hooks = { 'request' : [], 'response' : [] }
+        self._printer = JSONPrinter()
+        self._codec = get_codec()
+        self._compression = None
+
+    def _new_session (self):
+        # Shared by all verb methods so connections (and their TLS sessions)
+        # are kept alive and reused between JSON-RPC calls.
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self._pool_connections,
+                              pool_maxsize=self._pool_maxsize,
+                              pool_block=self._pool_block,
+                              max_retries=self._max_retries)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if self._keepalive:
+            session.headers.update({ 'connection' : 'keep-alive' })
+        else:
+            session.headers.update({ 'connection' : 'close' })
+        return session
+
+    def pool (self, connections=None, maxsize=None, block=None, retries=None,
+              keepalive=None):
+        if connections is not None:
+            self._pool_connections = connections
+        if maxsize is not None:
+            self._pool_maxsize = maxsize
+        if block is not None:
+            self._pool_block = block
+        if retries is not None:
+            self._max_retries = retries
+        if keepalive is not None:
+            self._keepalive = keepalive
+        self._session.close()
+        self._session = self._new_session()
+
+    def close (self):
+        self._session.close()
   
     def jprint (self,json_obj):
         return json.dumps(json_obj, indent=2, sort_keys=True)
     
     
     def dprint (self, msg, str):
-        if self._bbcode:
-            msg = '[color=#008080][b]'+msg+'[/b][/color]'
-            str = '[code]'+self.jprint(str)+'[/code]'
-        else:
-            str = self.jprint(str)
         if self._debug:
-            print(msg)
-            print(str)
-            
+            self._printer.dprint(msg, str)
+
+    def hook (self, event, callback):
+        # See ftntlib.hooks for the events and their info dict
+        if callback not in self._hooks[event]:
+            self._hooks[event] = self._hooks[event] + [ callback ]
+
+    def unhook (self, event, callback):
+        self._hooks[event] = [ h for h in self._hooks[event] if h != callback ]
+
+    def _trace (self, event, datagram, **info):
+        info['id'] = datagram.get('id')
+        info['method'] = datagram.get('method')
+        info['url'] = first_url(datagram)
+        info['datagram'] = datagram
+        for callback in self._hooks[event]:
+            callback(info)
                                   
     def debug (self, status):
         if status == 'on':
             self._debug = True
+            self.hook('request', self._printer.request)
+            self.hook('response', self._printer.response)
         if status == 'off':
             self._debug = False
+            self.unhook('request', self._printer.request)
+            self.unhook('response', self._printer.response)
             
             
     def bbcode (self, status):
@@ -67,6 +151,7 @@ class FortiAnalyzerJSON (object):
             self._bbcode = True
         if status == 'off':
             self._bbcode = False
+        self._printer.bbcode = self._bbcode
     
     
     def skip (self, status):
@@ -94,13 +179,82 @@ class FortiAnalyzerJSON (object):
     
     
     def params (self, params):
+        # Extra params for the next request of this thread/asyncio task
         if params:
-            self._params = params
+            pending = dict(_pending_params.get())
+            pending[self] = params
+            _pending_params.set(pending)
 
     def timeout (self, timeout):
         if timeout:
             self._timeout = timeout
 
+    def codec (self, codec):
+        # 'auto', 'json', 'orjson' or a codec object, see ftntlib.codec
+        self._codec = get_codec(codec)
+
+    def compression (self, status, **settings):
+        # 'on' (settings: encoding, threshold, level, accept, see
+        # ftntlib.compression), 'off' or a Compression instance
+        self._compression = get_compression(self._compression, status, **settings)
+
+    def compression_stats (self):
+        if self._compression is None:
+            return None
+        return self._compression.stats()
+
+    @contextlib.contextmanager
+    def options (self, **options):
+        '''
+        Override the per-call options (root, skip, verbose, params, timeout)
+        for the calls made by the current thread or asyncio task:
+
+            with faz.options(timeout=30):
+                faz.get(url)
+        '''
+        current = _call_options.get()
+        merged = dict(current.get(self, {}))
+        merged.update(options)
+        scoped = dict(current)
+        scoped[self] = merged
+        token = _call_options.set(scoped)
+        try:
+            yield self
+        finally:
+            _call_options.reset(token)
+
+    def _next_reqid (self):
+        with self._reqid_lock:
+            reqid = self._reqid
+            self._reqid += 1
+        return reqid
+
+    def _resolve_options (self, options=None, pending=True):
+        resolved = { 'root' : self._rootpath if self._root else False,
+                     'skip' : self._skip,
+                     'verbose' : self._verbose,
+                     'params' : False,
+                     'timeout' : self._timeout }
+        if pending:
+            params = _pending_params.get()
+            if self in params:
+                resolved['params'] = params[self]
+                params = dict(params)
+                del params[self]
+                _pending_params.set(params)
+        resolved.update(_call_options.get().get(self, {}))
+        if options:
+            resolved.update(options)
+        return resolved
+
+    def _datagram_options (self, datagram, options):
+        if options['skip'] is not False:
+            datagram['skip'] = int(options['skip'])
+        if options['verbose']:
+            datagram['verbose'] = int(options['verbose'])
+        if options['root']:
+            datagram['root'] = options['root']
+
     def apiver(self, apiver=None):
         if apiver:
             self._apiver = apiver
@@ -123,48 +277,78 @@ class FortiAnalyzerJSON (object):
         else:
             pass # to do: warn  
 
-    def http_request (self,method,params):
-        headers = { 'content-type' : 'application/json' }
-        if self._params:
-            params[0].update(self._params)
-            self._params = False
+    def _exchange (self,method,params,options=None):
+        # Send one datagram, return the whole decoded response (or the
+        # transport exception)
+        options = self._resolve_options(options)
+        if options['params']:
+            params[0].update(options['params'])
 
         params[0]['apiver'] = self._apiver
-        datagram = { 'id' : self._reqid,
+        datagram = { 'id' : self._next_reqid(),
                      'jsonrpc': self._jsonrpc,
                      'session' : self._sid,
                      'method' : method,
                      'params' : params,
                     }
-        if self._skip is not False:
-            datagram['skip'] = int(self._skip)
-        if self._verbose:
-            datagram['verbose'] = int(self._verbose)
-        if self._root:
-            datagram['root'] = self._rootpath
-            
-        self.dprint('REQUEST:',datagram)
+        self._datagram_options(datagram, options)
+        return self._post(datagram, options)
 
+    def http_request (self,method,params,options=None):
+        response_json = self._exchange(method,params,options)
+        if isinstance(response_json, Exception):
+            return response_json
+        return self.response(response_json)
+
+    def _post (self, datagram, options):
+        headers = { 'content-type' : 'application/json' }
+        body = self._codec.dumps(datagram)
+        if self._compression is not None:
+            body = self._compression.encode(body, headers)
+
+        if self._hooks['request']:
+            self._trace('request', datagram, bytes=len(body))
+
+        response = None
+        error = None
+        start = time.perf_counter()
         try: 
-            response = requests.post(
+            response = self._session.post(
                                      self._url, 
-                                     data=json.dumps(datagram), 
+                                     data=body, 
                                      headers=headers,
                                      verify=self._ssl_verify, 
-                                     timeout=self._timeout
+                                     timeout=options['timeout']
                                      )
-            response = response.json()
+            response_json = self._codec.loads(response.content)
+            if self._compression is not None:
+                self._compression.received(response)
 
         except requests.exceptions.ConnectionError as cerr:
             print ('Connection ERROR: ', cerr)
-            return cerr
+            error = cerr
         except Exception as err:
             print ('ERROR: ', err)
-            return err
-        assert response['id'] == datagram['id']
-        self.dprint('RESPONSE:',response)
+            error = err
+
+        if self._hooks['response']:
+            info = { 'elapsed' : time.perf_counter() - start,
+                     'status_code' : None,
+                     'bytes' : 0 }
+            if response is not None:
+                info['status_code'] = response.status_code
+                info['bytes'] = len(response.content)
+            if error is None:
+                info['response'] = response_json
+            else:
+                info['error'] = error
+            self._trace('response', datagram, **info)
 
-        return self.response(response)
+        if error is not None:
+            return error
+        assert response_json['id'] == datagram['id']
+
+        return response_json
 
     def response (self, response):
         if self._sid == None and 'session' in response:
@@ -198,12 +382,10 @@ class FortiAnalyzerJSON (object):
         return response
 
     def _do (self,method,url,data={}):
-        store = { 'root' : self._root,
-                  'skip' : self._skip,
-                  'verbose' : self._verbose }
-        self._root = False
-        self._skip = False
-        self._verbose = False                         
+        # Helper calls never use the chroot/skip/verbose settings
+        options = { 'root' : False,
+                    'skip' : False,
+                    'verbose' : False }
         if method == 'get' or method == 'move':
             if data:
                 data['url'] = url
@@ -214,45 +396,18 @@ class FortiAnalyzerJSON (object):
             params = [{ 'url' : url }]
             if data:
                 params[0]['data'] = data
-        response = self.http_request(method,params)
-        self._root = store['root']
-        self._skip = store['skip']
-        self._verbose = store['verbose']
-        return response
+        return self.http_request(method,params,options)
 
-    def do (self,method,params):
-        return self.http_request(method,params)
+    def do (self,method,params,options=None):
+        return self.http_request(method,params,options)
 
     def baredo (self, datagram):
-        headers = { 'content-type' : 'application/json' }
-
-        if self._skip is not False:
-            datagram['skip'] = int(self._skip)
-        if self._verbose:
-            datagram['verbose'] = int(self._verbose)
-        if self._root:
-            datagram['root'] = self._rootpath
-            
-        self.dprint('REQUEST:',datagram)
-
-        try: 
-            response = requests.post(
-                                     self._url, 
-                                     data=json.dumps(datagram), 
-                                     headers=headers,
-                                     verify=self._ssl_verify, 
-                                     timeout=self._timeout
-                                     )
-            response = response.json()
-        except requests.exceptions.ConnectionError as cerr:
-            print ('Connection ERROR: ', cerr)
-            return cerr
-        except Exception as err:
-            print ('ERROR: ', err)
-            return err
-        assert response['id'] == datagram['id']
-        self.dprint('RESPONSE:',response)
-        return self.response(response) 
+        options = self._resolve_options(pending=False)
+        self._datagram_options(datagram, options)
+        response_json = self._post(datagram, options)
+        if isinstance(response_json, Exception):
+            return response_json
+        return self.response(response_json)
             
     def get (self,url,data={}):
         if data:
@@ -559,6 +714,481 @@ class FortiAnalyzerJSON (object):
         return status, response
     
 
+    # Log view methods
+
+    def _logview (self, method, url, params={}):
+        # Log view calls take their arguments at the params level and answer
+        # with a bare result (apiver 3) or a JSON-RPC error
+        params = dict(params)
+        params['url'] = url
+        options = { 'root' : False,
+                    'skip' : False,
+                    'verbose' : False }
+        response_json = self._exchange(method, [ params ], options)
+        if isinstance(response_json, Exception):
+            raise FortiAnalyzerJSONError(url, response_json)
+        if 'error' in response_json:
+            raise FortiAnalyzerJSONError(url, response_json['error'])
+        result = response_json.get('result')
+        if isinstance(result, list):
+            # apiver 1 style: [ { 'status' : ..., 'data' : ... } ]
+            result = result[0] if result else {}
+            if result.get('status', {}).get('code', 0) != 0:
+                raise FortiAnalyzerJSONError(url, result['status'])
+            return result.get('data')
+        if isinstance(result, dict) and result.get('status', {}).get('code', 0) != 0:
+            raise FortiAnalyzerJSONError(url, result['status'])
+        return result
+
+    def _logtime (self, value):
+        # datetime objects or 'YYYY-MM-DD HH:MM:SS' strings
+        if hasattr(value, 'strftime'):
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        return value
+
+    def _logseconds (self, value):
+        # Times are only shifted and compared: the wall clock time is
+        # converted to seconds as if it was UTC, whatever the search timezone
+        if isinstance(value, str):
+            value = datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+        return calendar.timegm(value.timetuple())
+
+    def _logdate (self, seconds):
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(seconds))
+
+    def logsearch_start (self, adom, logtype, start, end, device=None,
+                         filter=None, time_order='desc', timezone=None):
+        '''
+        Start a log search task and return its tid.
+
+        device: None (all FortiGates), a devid or a list of devids (or of
+                { 'devid' : ..., 'vdom' : ... } dicts)
+        '''
+        if device is None:
+            device = [ { 'devid' : 'All_FortiGate' } ]
+        elif isinstance(device, str):
+            device = [ { 'devid' : device } ]
+        else:
+            device = [ d if isinstance(d, dict) else { 'devid' : d }
+                       for d in device ]
+        params = { 'logtype' : logtype,
+                   'device' : device,
+                   'time-order' : time_order,
+                   'time-range' : { 'start' : self._logtime(start),
+                                    'end' : self._logtime(end) } }
+        if filter:
+            params['filter'] = filter
+        if timezone:
+            params['timezone'] = timezone
+        url = 'logview/adom/'+str(adom)+'/logsearch'
+        return self._logview('add', url, params)['tid']
+
+    def logsearch_count (self, adom, tid):
+        url = 'logview/adom/'+str(adom)+'/logsearch/count/'+str(tid)
+        return self._logview('get', url)
+
+    def logsearch_poll (self, adom, tid, timeout=None, interval=0.2,
+                        max_interval=5, page_size=None, stop=None):
+        '''
+        Poll the search count and yield each count result, the last one
+        having progress-percent 100. When the stop threading.Event is set,
+        polling ends with FortiAnalyzerJSONError.
+
+        The poll interval follows the search: about half the remaining time
+        estimated from the progress rate (or, with page_size, the time for
+        page_size more rows to match if shorter), between interval and
+        max_interval. It grows by 1.5 while the count doesn't change.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        last = None
+        wait = interval
+        while True:
+            if stop is not None and stop.is_set():
+                url = 'logview/adom/'+str(adom)+'/logsearch/'+str(tid)
+                raise FortiAnalyzerJSONError(url, 'Search cancelled')
+            count = self.logsearch_count(adom, tid)
+            now = time.time()
+            yield count
+            progress = count.get('progress-percent', 0)
+            if progress == 100:
+                return
+            if deadline is not None and now >= deadline:
+                url = 'logview/adom/'+str(adom)+'/logsearch/'+str(tid)
+                raise FortiAnalyzerJSONError(url, 'Search not finished after '
+                                             + str(timeout) + ' s')
+            matched = count.get('matched-logs', 0)
+            if last is not None:
+                elapsed = now - last[0]
+                estimates = []
+                if progress > last[1]:
+                    estimates.append((100 - progress) * elapsed
+                                     / (progress - last[1]) / 2)
+                if page_size and matched > last[2]:
+                    estimates.append(page_size * elapsed / (matched - last[2]))
+                if estimates:
+                    wait = min(estimates)
+                else:
+                    wait = wait * 1.5
+            wait = max(interval, min(max_interval, wait))
+            last = (now, progress, matched)
+            if deadline is not None:
+                wait = max(0, min(wait, deadline - time.time()))
+            if stop is not None:
+                stop.wait(wait)
+            else:
+                time.sleep(wait)
+
+    def logsearch_wait (self, adom, tid, timeout=None, interval=0.2,
+                        max_interval=5, stop=None):
+        '''
+        Wait for the search to reach progress-percent 100 (see
+        logsearch_poll) and return the last count result (matched-logs,
+        scanned-logs, total-logs...).
+        '''
+        for count in self.logsearch_poll(adom, tid, timeout, interval,
+                                         max_interval, stop=stop):
+            pass
+        return count
+
+    def logsearch_fetch (self, adom, tid, offset=0, limit=1000):
+        url = 'logview/adom/'+str(adom)+'/logsearch/'+str(tid)
+        return self._logview('get', url, { 'offset' : offset,
+                                           'limit' : limit })
+
+    def logsearch_delete (self, adom, tid):
+        url = 'logview/adom/'+str(adom)+'/logsearch/'+str(tid)
+        return self._logview('delete', url)
+
+    def _logsearch_fetch_retry (self, adom, tid, offset, limit, retries):
+        # A failed page is fetched again, the search itself is kept
+        for attempt in range(retries + 1):
+            try:
+                return self.logsearch_fetch(adom, tid, offset, limit)
+            except FortiAnalyzerJSONError:
+                if attempt == retries:
+                    raise
+                time.sleep(0.5 * 2 ** attempt)
+
+    def logsearch_fetch_pages (self, adom, tid, total, page_size=1000,
+                               workers=4, ordered=True, retries=2, offset=0):
+        '''
+        Fetch the total rows of a finished search with workers concurrent
+        offset/limit requests and yield one list of rows per page.
+
+        ordered: yield the pages in the search order, or as they arrive
+        retries: attempts per failed page before FortiAnalyzerJSONError is
+                 raised
+
+        At most 2 * workers pages are fetched or waiting at a time. The
+        rows before offset are skipped. A page shorter than expected is
+        completed by fetching its missing rows before the next page, a page
+        with none of its rows raises FortiAnalyzerJSONError.
+        '''
+        url = 'logview/adom/'+str(adom)+'/logsearch/'+str(tid)
+        offsets = iter(range(offset, total, page_size))
+        futures = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            def fetch (offset, limit):
+                return (offset, limit,
+                        executor.submit(self._logsearch_fetch_retry, adom, tid,
+                                        offset, limit, retries))
+            def submit ():
+                for offset in offsets:
+                    futures.append(fetch(offset, page_size))
+                    return True
+                return False
+            try:
+                while len(futures) < 2 * workers and submit():
+                    pass
+                while futures:
+                    if ordered:
+                        item = futures.popleft()
+                    else:
+                        done, _ = concurrent.futures.wait(
+                            [ future for _, _, future in futures ],
+                            return_when=concurrent.futures.FIRST_COMPLETED)
+                        item = next(item for item in futures if item[2] in done)
+                        futures.remove(item)
+                    start, limit, future = item
+                    rows = future.result().get('data') or []
+                    expected = min(limit, total - start)
+                    if len(rows) < expected:
+                        if not rows:
+                            raise FortiAnalyzerJSONError(
+                                url, 'No rows at offset {}, {} expected'.format(
+                                    start, expected))
+                        # The missing rows come right after this page
+                        futures.appendleft(fetch(start + len(rows),
+                                                 expected - len(rows)))
+                    else:
+                        submit()
+                    yield rows
+            finally:
+                for _, _, future in futures:
+                    future.cancel()
+
+    def _logsearch_read (self, adom, tid, total, page_size, prefetch, workers,
+                         ordered, retries, offset=0):
+        # Rows of a finished search from offset, one list per page
+        if workers > 1:
+            for rows in self.logsearch_fetch_pages(adom, tid, total, page_size,
+                                                   workers, ordered, retries,
+                                                   offset):
+                yield rows
+            return
+        executor = None
+        if prefetch:
+            executor = concurrent.futures.ThreadPoolExecutor(1)
+        pending = None
+        try:
+            while offset < total:
+                if pending is not None:
+                    page = pending.result()
+                    pending = None
+                else:
+                    page = self._logsearch_fetch_retry(adom, tid, offset,
+                                                       page_size, retries)
+                rows = page.get('data') or []
+                if not rows:
+                    break
+                offset += len(rows)
+                if executor is not None and offset < total:
+                    pending = executor.submit(self._logsearch_fetch_retry,
+                                              adom, tid, offset, page_size,
+                                              retries)
+                yield rows
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+    def logsearch_pages (self, adom, logtype, start, end, device=None,
+                         filter=None, page_size=1000, time_order='desc',
+                         timezone=None, timeout=None, interval=0.2,
+                         prefetch=True, workers=1, ordered=True, retries=2,
+                         early=False):
+        '''
+        Run a log search and yield its rows, one list per page of page_size
+        rows.
+
+        The next page is fetched (prefetch) while the caller handles the
+        current one, so at most two pages are held in memory. With workers
+        above 1, the pages are fetched concurrently (see
+        logsearch_fetch_pages for ordered and retries). The search is
+        deleted on FortiAnalyzer when the generator ends or is closed.
+        Raise FortiAnalyzerJSONError on error.
+
+        early: yield the rows already matched while the search is running
+               (the first ones as soon as there are some, then full pages),
+               for callers which don't need the complete result before
+               starting. The remaining rows are read once the search is
+               finished.
+        '''
+        tid = self.logsearch_start(adom, logtype, start, end, device, filter,
+                                   time_order, timezone)
+        try:
+            offset = 0
+            for count in self.logsearch_poll(adom, tid, timeout, interval,
+                                             page_size=page_size if early
+                                             else None):
+                total = count.get('matched-logs', 0)
+                if not early or count.get('progress-percent') == 100:
+                    continue
+                while total - offset >= page_size or (offset == 0 and total):
+                    page = self._logsearch_fetch_retry(adom, tid, offset,
+                                                       page_size, retries)
+                    rows = page.get('data') or []
+                    if not rows:
+                        break
+                    offset += len(rows)
+                    yield rows
+            for rows in self._logsearch_read(adom, tid, total, page_size,
+                                             prefetch, workers, ordered,
+                                             retries, offset):
+                yield rows
+        finally:
+            try:
+                self.logsearch_delete(adom, tid)
+            except FortiAnalyzerJSONError:
+                pass
+
+    def logsearch (self, adom, logtype, start, end, device=None, filter=None,
+                   page_size=1000, **options):
+        '''
+        Run a log search and yield its rows one by one:
+
+            for row in faz.logsearch('root', 'traffic',
+                                     '2024-01-01 00:00:00',
+                                     '2024-01-02 00:00:00',
+                                     filter='srcip=10.0.0.1'):
+                ...
+
+        See logsearch_pages() for the other options.
+        '''
+        for rows in self.logsearch_pages(adom, logtype, start, end, device,
+                                         filter, page_size, **options):
+            for row in rows:
+                yield row
+
+    def logsearch_matched (self, adom, logtype, start, end, device=None,
+                           filter=None, timezone=None, timeout=None,
+                           interval=0.2):
+        '''
+        Run a search only to count its rows (matched-logs).
+        '''
+        tid = self.logsearch_start(adom, logtype, start, end, device, filter,
+                                   timezone=timezone)
+        try:
+            count = self.logsearch_wait(adom, tid, timeout, interval)
+            return count.get('matched-logs', 0)
+        finally:
+            try:
+                self.logsearch_delete(adom, tid)
+            except FortiAnalyzerJSONError:
+                pass
+
+    def _logsplit (self, start, end, count):
+        # count windows covering the seconds start to end (both included)
+        count = max(1, min(count, end - start + 1))
+        step = (end - start + 1) / float(count)
+        bounds = [ start + int(round(i * step)) for i in range(count) ]
+        bounds.append(end + 1)
+        return [ (bounds[i], bounds[i + 1] - 1) for i in range(count) ]
+
+    def logsearch_plan (self, adom, logtype, start, end, device=None,
+                        filter=None, window=None, rows_per_window=None,
+                        probes=8, probe_window=60, max_searches=4,
+                        timezone=None, interval=0.2):
+        '''
+        Split the start to end time range into windows for
+        logsearch_sharded(). Return a list of (start, end) strings in
+        ascending time order.
+
+        window: fixed window duration (seconds or timedelta)
+        rows_per_window: target number of rows per window. The range is cut
+                         in probes segments, the log rate of each segment is
+                         estimated with a search over probe_window seconds in
+                         its middle (max_searches probes at a time), then
+                         each segment is split according to its estimate.
+        '''
+        first = self._logseconds(start)
+        last = self._logseconds(end)
+        if window is not None:
+            if hasattr(window, 'total_seconds'):
+                window = window.total_seconds()
+            count = int(-(-(last - first + 1) // int(window)))
+            windows = self._logsplit(first, last, count)
+        elif rows_per_window is not None:
+            segments = self._logsplit(first, last, probes)
+            def estimate (segment):
+                middle = (segment[0] + segment[1]) // 2
+                probe = self._logsplit(max(segment[0], middle - probe_window // 2),
+                                       min(segment[1], middle + probe_window // 2),
+                                       1)[0]
+                matched = self.logsearch_matched(adom, logtype,
+                                                 self._logdate(probe[0]),
+                                                 self._logdate(probe[1]),
+                                                 device, filter, timezone,
+                                                 interval=interval)
+                rate = matched / float(probe[1] - probe[0] + 1)
+                return rate * (segment[1] - segment[0] + 1)
+            with concurrent.futures.ThreadPoolExecutor(max_searches) as executor:
+                estimates = list(executor.map(estimate, segments))
+            windows = []
+            for segment, rows in zip(segments, estimates):
+                count = int(-(-rows // rows_per_window)) or 1
+                windows.extend(self._logsplit(segment[0], segment[1], count))
+        else:
+            windows = [ (first, last) ]
+        return [ (self._logdate(a), self._logdate(b)) for a, b in windows ]
+
+    def logsearch_sharded (self, adom, logtype, start, end, device=None,
+                           filter=None, window=None, rows_per_window=None,
+                           max_searches=4, page_size=1000, time_order='desc',
+                           timezone=None, timeout=None, interval=0.2,
+                           prefetch=True, workers=1, retries=2, **plan):
+        '''
+        Split the time range in windows (see logsearch_plan), run one log
+        search per window and yield the rows, one list per page, in time
+        order.
+
+        Up to max_searches searches run on FortiAnalyzer at the same time:
+        while the rows of a window are read, the next windows are already
+        searched. Only the rows being read are held in memory. The searches
+        are deleted when the generator ends or is closed:
+
+            for rows in faz.logsearch_sharded('root', 'traffic',
+                                              '2024-01-01 00:00:00',
+                                              '2024-01-31 00:00:00',
+                                              rows_per_window=1000000,
+                                              max_searches=4):
+                ...
+
+        Raise FortiAnalyzerJSONError on error.
+        '''
+        windows = self.logsearch_plan(adom, logtype, start, end, device,
+                                      filter, window, rows_per_window,
+                                      max_searches=max_searches,
+                                      timezone=timezone, interval=interval,
+                                      **plan)
+        if time_order == 'desc':
+            windows.reverse()
+        windows = iter(windows)
+        tids = set()
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        def search (window):
+            if stop.is_set():
+                return None, 0
+            tid = self.logsearch_start(adom, logtype, window[0], window[1],
+                                       device, filter, time_order, timezone)
+            with lock:
+                stopped = stop.is_set()
+                if not stopped:
+                    tids.add(tid)
+            if stopped:
+                # Started after the generator was closed
+                self.logsearch_delete(adom, tid)
+                return None, 0
+            count = self.logsearch_wait(adom, tid, timeout, interval,
+                                        stop=stop)
+            return tid, count.get('matched-logs', 0)
+
+        futures = collections.deque()
+        executor = concurrent.futures.ThreadPoolExecutor(max_searches)
+        def submit ():
+            for window in windows:
+                futures.append(executor.submit(search, window))
+                return
+        try:
+            for i in range(max_searches):
+                submit()
+            while futures:
+                tid, total = futures.popleft().result()
+                for rows in self._logsearch_read(adom, tid, total, page_size,
+                                                 prefetch, workers, True,
+                                                 retries):
+                    yield rows
+                with lock:
+                    tids.discard(tid)
+                self.logsearch_delete(adom, tid)
+                submit()
+        finally:
+            # The running searches stop polling, their tids are deleted
+            # without waiting for them
+            stop.set()
+            for future in futures:
+                future.cancel()
+            with lock:
+                running = list(tids)
+                tids.clear()
+            for tid in running:
+                try:
+                    self.logsearch_delete(adom, tid)
+                except FortiAnalyzerJSONError:
+                    pass
+            executor.shutdown(wait=False)
+
     # Workflow methods
     """
     def _workflow (self, adom, action, session=False, params=False):
@@ -0,0 +1,122 @@
+# coding: utf-8
+
+"""
+fmg_batch.py
+
+Collect FortiManager JSON-RPC calls and send them as multi-entry datagrams.
+"""
+
+import itertools
+
+
+class FortiManagerJSONBatch(object):
+    """
+    Batch of JSON-RPC calls sent with as few datagrams as possible.
+
+    Consecutive calls using the same method are packed into the params list
+    of a single datagram, chunk_size entries at a time. The call order is
+    preserved and commit() returns one (status, data) tuple per call.
+
+    Usage:
+
+        with fmg.batch(chunk_size=500) as batch:
+            for address in addresses:
+                batch.add(url, address)
+        for status, data in batch.results:
+            ...
+    """
+
+    def __init__(self, fmg, chunk_size=100):
+        self._fmg = fmg
+        self._chunk_size = chunk_size
+        self._entries = []
+        self.results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self._entries = []
+        return False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _queue(self, method, params):
+        self._entries.append((method, params))
+        return len(self.results) + len(self._entries) - 1
+
+    def _queue_options(self, method, url, data):
+        params = dict(data) if data else {}
+        params["url"] = url
+        return self._queue(method, params)
+
+    def _queue_data(self, method, url, data):
+        params = {"url": url}
+        if data:
+            params["data"] = data
+        return self._queue(method, params)
+
+    def get(self, url, data={}):
+        return self._queue_options("get", url, data)
+
+    def add(self, url, data={}):
+        return self._queue_data("add", url, data)
+
+    def update(self, url, data={}):
+        return self._queue_data("update", url, data)
+
+    def set(self, url, data={}):
+        return self._queue_data("set", url, data)
+
+    def unset(self, url, data={}):
+        return self._queue_data("unset", url, data)
+
+    def delete(self, url, data={}):
+        return self._queue_data("delete", url, data)
+
+    def replace(self, url, data={}):
+        return self._queue_data("replace", url, data)
+
+    def clone(self, url, data={}):
+        return self._queue_data("clone", url, data)
+
+    def move(self, url, data):
+        return self._queue_options("move", url, data)
+
+    def execute(self, url, data={}):
+        return self._queue_data("exec", url, data)
+
+    def _chunks(self):
+        entries = self._entries
+        self._entries = []
+        for method, group in itertools.groupby(entries, key=lambda entry: entry[0]):
+            params = [entry[1] for entry in group]
+            for start in range(0, len(params), self._chunk_size):
+                yield method, params[start : start + self._chunk_size]
+
+    def _chunk_results(self, chunk, response):
+        if isinstance(response, Exception):
+            status = {"code": 1, "message": str(response)}
+            return [(status, {})] * len(chunk)
+        if len(response) < len(chunk):
+            status = {"code": 1, "message": "Missing result from host."}
+            response = response + [(status, {})] * (len(chunk) - len(response))
+        return response[: len(chunk)]
+
+    def commit(self):
+        """
+        Send the pending calls.
+
+        Return the (status, data) tuples of the calls sent by this commit.
+        They are also appended to self.results.
+        """
+        results = []
+        for method, chunk in self._chunks():
+            response = self._fmg.http_request_list(method, chunk)
+            results.extend(self._chunk_results(chunk, response))
+        self.results.extend(results)
+        return results
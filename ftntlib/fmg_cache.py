@@ -0,0 +1,125 @@
+# coding: utf-8
+
+"""
+fmg_cache.py
+
+Read-through cache for FortiManagerJSON get requests.
+"""
+
+import collections
+import json
+import threading
+import time
+
+# Methods invalidating the cached entries of the URLs they touch
+WRITE_METHODS = ("add", "set", "update", "unset", "delete", "replace", "clone", "move")
+
+
+def _path(url):
+    return "/" + str(url).strip("/") + "/"
+
+
+class ResponseCache(object):
+    """
+    LRU cache of get responses with a time to live.
+
+    Entries are keyed by URL, canonicalized get options and the client
+    (FortiManager and user) they were fetched by. They are stored
+    encoded (bytes), so callers can't alter a cached response and the size
+    limit is exact.
+
+    ttl: seconds an entry stays valid (None: until evicted or invalidated)
+    max_entries: maximum number of entries
+    max_bytes: maximum total size of the encoded entries
+
+    A write (see WRITE_METHODS) on a URL invalidates the entries of that URL,
+    of its parents and of its children: an add on .../obj/firewall/address
+    drops .../obj/firewall/address and .../obj/firewall/address/<name>.
+    exec requests don't invalidate anything, call clear() when needed.
+    """
+
+    def __init__(self, ttl=60, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        return self._bytes
+
+    def key(self, params, root=False, verbose=False, client=None):
+        options = dict(params)
+        url = options.pop("url", "")
+        return (
+            _path(url),
+            root or "",
+            int(verbose),
+            json.dumps(options, sort_keys=True, default=str),
+            client,
+        )
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires is None or expires > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._drop(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        expires = None if self.ttl is None else time.time() + self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (expires, value)
+            self._bytes += len(value)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        expires, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def invalidate(self, url):
+        """
+        Drop the entries of url, of its parents and of its children.
+        """
+        path = _path(url)
+        with self._lock:
+            for key in list(self._entries):
+                if key[0].startswith(path) or path.startswith(key[0]):
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
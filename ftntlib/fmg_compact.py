@@ -0,0 +1,211 @@
+# coding: utf-8
+
+"""
+fmg_compact.py
+
+Compact columnar storage for large FortiManager table responses.
+"""
+
+import array
+import sys
+
+from .codec import get_codec
+
+# Code of the absent attributes
+MISSING = 0
+
+_absent = object()
+
+
+class CompactTable(object):
+    """
+    Columnar, dictionary-encoded copy of a list of table entries.
+
+    Each attribute is a column of integer codes (array("I"), 4 bytes per
+    cell) pointing in the list of the distinct values of the column.
+    Repeated values (interfaces, types, colors...) are stored once and
+    strings are interned. Lists and dicts are stored encoded and only
+    decoded when accessed, so memory grows with the number of distinct
+    values rather than with the number of entries:
+
+        table = fmg.get_compact("pm/config/adom/root/obj/firewall/address")
+        len(table)
+        table[0]["name"]
+        for row in table:
+            if row["type"] == 0:
+                print(row.to_dict())
+        colors = list(table.column("color"))
+
+    codec: codec used for the list and dict values (see codec.get_codec)
+    """
+
+    __slots__ = ("_codec", "_length", "_columns", "_values", "_index")
+
+    def __init__(self, rows=(), codec=None):
+        self._codec = get_codec(codec)
+        self._length = 0
+        self._columns = {}
+        self._values = {}
+        self._index = {}
+        self.extend(rows)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("CompactTable index out of range")
+        return CompactRow(self, index)
+
+    def __iter__(self):
+        for index in range(self._length):
+            yield CompactRow(self, index)
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    @staticmethod
+    def _token(value):
+        if isinstance(value, (str, bytes)):
+            # Strings and encoded lists/dicts never equal another type
+            return value
+        # True == 1 == 1.0 but they must not share a code
+        return (type(value), value)
+
+    def _encode(self, key, value):
+        if isinstance(value, (list, dict)):
+            value = self._codec.dumps(value)
+        elif isinstance(value, str):
+            value = sys.intern(value)
+        index = self._index.get(key)
+        if index is None:
+            # Frozen column, rebuild its reverse index
+            index = self._index[key] = dict(
+                (self._token(known), code)
+                for code, known in enumerate(self._values[key])
+                if code != MISSING
+            )
+        token = self._token(value)
+        code = index.get(token)
+        if code is None:
+            code = len(self._values[key])
+            self._values[key].append(value)
+            index[token] = code
+        return code
+
+    def freeze(self):
+        """
+        Drop the value -> code indexes only needed to add entries, which
+        take about a third of the memory of a loaded table. The table can
+        still be extended, the indexes are then rebuilt.
+        """
+        self._index = {}
+        return self
+
+    def _decode(self, key, code):
+        value = self._values[key][code]
+        if isinstance(value, bytes):
+            return self._codec.loads(value)
+        return value
+
+    def append(self, row):
+        for key in row:
+            if key not in self._columns:
+                key = sys.intern(key)
+                self._columns[key] = array.array("I", [MISSING]) * self._length
+                # Code 0 is reserved for the absent attributes
+                self._values[key] = [None]
+                self._index[key] = {}
+        for key, column in self._columns.items():
+            if key in row:
+                column.append(self._encode(key, row[key]))
+            else:
+                column.append(MISSING)
+        self._length += 1
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def has(self, index, key):
+        column = self._columns.get(key)
+        return column is not None and column[index] != MISSING
+
+    def get(self, index, key, default=None):
+        column = self._columns.get(key)
+        if column is None or column[index] == MISSING:
+            return default
+        return self._decode(key, column[index])
+
+    def column(self, key, default=None):
+        """
+        Iterate over the values of an attribute.
+        """
+        column = self._columns.get(key)
+        for index in range(self._length):
+            if column is None or column[index] == MISSING:
+                yield default
+            else:
+                yield self._decode(key, column[index])
+
+    def distinct(self, key):
+        """
+        Return the distinct values of an attribute.
+        """
+        values = self._values.get(key, [None])
+        return [self._decode(key, code) for code in range(1, len(values))]
+
+    def to_dict(self, index):
+        return dict(
+            (key, self._decode(key, column[index]))
+            for key, column in self._columns.items()
+            if column[index] != MISSING
+        )
+
+    def to_list(self):
+        return [self.to_dict(index) for index in range(self._length)]
+
+
+class CompactRow(object):
+    """
+    Read-only view of a CompactTable entry, values are decoded on access.
+    """
+
+    __slots__ = ("_table", "_index")
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def __getitem__(self, key):
+        value = self._table.get(self._index, key, _absent)
+        if value is _absent:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self._table.has(self._index, key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return "CompactRow({!r})".format(self.to_dict())
+
+    def get(self, key, default=None):
+        return self._table.get(self._index, key, default)
+
+    def keys(self):
+        return [key for key in self._table.columns if key in self]
+
+    def items(self):
+        return self.to_dict().items()
+
+    def to_dict(self):
+        return self._table.to_dict(self._index)
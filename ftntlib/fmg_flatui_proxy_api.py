@@ -9,6 +9,8 @@ import json
 
 from requests import Session
 
+from .codec import get_codec
+
 if sys.version_info >= (2, 7):
     logging.captureWarnings(True)
 else:
@@ -33,6 +35,7 @@ class FmgFlatuiProxyApi:
         self._debug = None
         self._debug_cookie = None
         self._debug_header = None
+        self._codec = get_codec()
 
     def debug(self, value):
         """
@@ -97,6 +100,18 @@ class FmgFlatuiProxyApi:
 
         return self._debug_header
 
+    def codec(self, codec):
+        """
+        Select the JSON codec used for payloads and responses.
+
+        Parameters
+        ----------
+        codec: str or object
+            "auto" (orjson when installed), "json", "orjson" or an object
+            with dumps(obj) -> bytes and loads(bytes) methods.
+        """
+        self._codec = get_codec(codec)
+
     def debug_print(self, response):
         """
         Print the HTTP debub.
@@ -219,7 +234,9 @@ class FmgFlatuiProxyApi:
         # This request will retrieve the CURRENT_SESSION and HTTP_CSRF_TOKEN
         # cookies. They will be conserved automatically by the requests.Session
         # object.
-        response1 = self._session.post(login_url1, json=request_body, verify=False)
+        response1 = self._session.post(
+            login_url1, data=self._codec.dumps(request_body), verify=False
+        )
         response1.raise_for_status()
         self.debug_print(response1)
 
@@ -267,7 +284,9 @@ class FmgFlatuiProxyApi:
             response = self._session.get(url, params=params)
 
         elif method == "post":
-            response = self._session.post(url, params=params, json=payload)
+            if payload is not None:
+                payload = self._codec.dumps(payload)
+            response = self._session.post(url, params=params, data=payload)
 
         else:
             raise InvalidHTTPMethod('Wrong method "{}"'.format(method))
@@ -275,7 +294,7 @@ class FmgFlatuiProxyApi:
         response.raise_for_status()
         self.debug_print(response)
 
-        return response.json()
+        return self._codec.loads(response.content)
 
     def deploymng(self, action, payload, method="post"):
         """
@@ -326,7 +345,7 @@ class FmgFlatuiProxyApi:
 
         self.debug_print(response)
 
-        return response.json()
+        return self._codec.loads(response.content)
 
 
 # Main
@@ -0,0 +1,186 @@
+# coding: utf-8
+
+"""
+fmg_install.py
+
+Install policy packages on many ADOMs and devices at once, in waves.
+"""
+
+import collections
+import time
+
+from .fmg_jsonapi import TASK_TIMEOUT
+from .fmg_tasks import TaskPool
+
+
+def waves(targets, canary=1):
+    """
+    Split targets in a canary wave (the first canary targets) and the rest.
+    """
+    targets = list(targets)
+    return [wave for wave in (targets[:canary], targets[canary:]) if wave]
+
+
+class PackageInstaller(object):
+    """
+    Concurrent securityconsole/install/package orchestrator.
+
+    fmg: a logged-in FortiManagerJSON
+    max_tasks: install tasks running at the same time
+    timeout: seconds given to each wave, the targets not started by then
+             are skipped (None: no limit)
+    flags: install flags
+    abort: don't start the next wave when a wave has a failure
+    progress: optional callable(target, result) called when an install
+              task finishes
+
+    A target is a dict with adom, package and scope (list of
+    {"name": device, "vdom": vdom}). Targets are installed wave by wave,
+    all the tasks of a wave being tracked together:
+
+        installer = PackageInstaller(fmg, max_tasks=8)
+        summary = installer.run(waves(targets, canary=1))
+        for device in summary["devices"]:
+            print(device["device"], device["status"], device["duration"])
+
+    run() returns {"targets": [...], "devices": [...], "ok", "failed",
+    "skipped", "elapsed"}. targets has one result per target (task, status,
+    percent, num_err, elapsed), devices one per device line of the install
+    tasks (adom, package, device, vdom, status, detail, start, end,
+    duration).
+    """
+
+    def __init__(
+        self,
+        fmg,
+        max_tasks=4,
+        timeout=None,
+        flags=["install_chg"],
+        abort=True,
+        progress=None,
+    ):
+        self._fmg = fmg
+        self._max_tasks = max_tasks
+        self._timeout = timeout
+        self._flags = flags
+        self._abort = abort
+        self._progress = progress
+
+    def run(self, waves):
+        """
+        Install the waves of targets, a list of lists of targets.
+        """
+        start = time.time()
+        targets = []
+        devices = []
+        failed = False
+        for wave in waves:
+            if failed and self._abort:
+                for target in wave:
+                    targets.append(self._result(target, "skipped"))
+                continue
+            results, lines = self._wave(wave)
+            targets.extend(results)
+            devices.extend(lines)
+            failed = failed or any(r["status"] != "ok" for r in results)
+        counts = collections.Counter(target["status"] for target in targets)
+        return {
+            "targets": targets,
+            "devices": devices,
+            "ok": counts["ok"],
+            "failed": counts["failed"],
+            "skipped": counts["skipped"],
+            "elapsed": time.time() - start,
+        }
+
+    def _result(self, target, status, task=None, error=None, elapsed=0.0):
+        return {
+            "adom": target["adom"],
+            "package": target["package"],
+            "task": task,
+            "status": status,
+            "error": error,
+            "percent": None,
+            "num_err": None,
+            "elapsed": elapsed,
+        }
+
+    def _command(self, target):
+        url = "securityconsole/install/package"
+        data = {
+            "adom": target["adom"],
+            "pkg": "adom/" + target["adom"] + "/pkg/" + target["package"],
+            "flags": target.get("flags", self._flags),
+            "scope": target["scope"],
+        }
+        return url, data
+
+    def _wave(self, wave):
+        start = time.time()
+        tasks = TaskPool(self._fmg, self._max_tasks, self._timeout)
+        pending = collections.deque(wave)
+        results = {}
+        lines = []
+        while pending or tasks:
+            while pending and tasks.available():
+                target = pending.popleft()
+                url, data = self._command(target)
+                taskid, status = tasks.launch(url, data, target)
+                if not taskid:
+                    results[id(target)] = self._result(target, "failed", error=status)
+            if not tasks:
+                # Out of time before installing the remaining targets
+                for target in pending:
+                    results[id(target)] = self._result(target, "skipped")
+                pending.clear()
+                break
+            for target, taskid, status, task in tasks.wait():
+                result = self._task_done(target, taskid, status, task, start)
+                results[id(target)] = result
+                lines.extend(self._lines(target, task))
+                if self._progress:
+                    self._progress(target, result)
+        return [results[id(target)] for target in wave], lines
+
+    def _task_done(self, target, taskid, status, task, start):
+        result = self._result(target, "ok", taskid, elapsed=time.time() - start)
+        if status == TASK_TIMEOUT:
+            result["status"] = "failed"
+            result["error"] = "timeout"
+            if isinstance(task, dict):
+                result["percent"] = task.get("percent")
+            return result
+        if status.get("code") != 0 or not isinstance(task, dict):
+            result["status"] = "failed"
+            result["error"] = status
+            return result
+        result["percent"] = task.get("percent")
+        result["num_err"] = task.get("num_err")
+        if task.get("percent") != 100:
+            result["status"] = "failed"
+            result["error"] = "timeout"
+        elif task.get("num_err"):
+            result["status"] = "failed"
+        return result
+
+    def _lines(self, target, task):
+        if not isinstance(task, dict):
+            return []
+        devices = []
+        for line in task.get("line") or []:
+            start = line.get("start_tm")
+            end = line.get("end_tm")
+            devices.append(
+                {
+                    "adom": target["adom"],
+                    "package": target["package"],
+                    "device": line.get("name"),
+                    "vdom": line.get("vdom"),
+                    "status": "failed" if line.get("err") else "ok",
+                    "detail": line.get("detail"),
+                    "start": start,
+                    "end": end,
+                    "duration": end - start if start and end else None,
+                }
+            )
+        return devices
@@ -0,0 +1,125 @@
+# coding: utf-8
+
+"""
+fmg_inventory.py
+
+In-memory FortiManager device inventory indexed for O(1) lookups.
+"""
+
+import threading
+import time
+
+
+class DeviceInventory(object):
+    """
+    Device inventory loaded from dvmdb/device in a few paged requests.
+
+    fmg: a logged-in FortiManagerJSON
+    ttl: seconds after which the inventory is reloaded on the next lookup
+         (None: only reloaded by refresh())
+    page_size: devices per dvmdb/device request
+    adoms: also load the ADOM membership of the devices (one dvmdb/adom
+           request plus one batched request for all the ADOMs)
+
+    Devices are indexed by name, serial number, IP, VDOM devid and ADOM:
+
+        inventory = DeviceInventory(fmg, ttl=300)
+        fmg.inventory(inventory)  # used by get_devid() and promote_device()
+        device = inventory.by_sn("FGVM01TM00000001")
+        for device in inventory.in_adom("root"):
+            ...
+    """
+
+    def __init__(self, fmg, ttl=None, page_size=1000, adoms=True):
+        self._fmg = fmg
+        self._ttl = ttl
+        self._page_size = page_size
+        self._adoms = adoms
+        self._lock = threading.Lock()
+        self._loaded = None
+        self._indexes = None
+
+    def refresh(self):
+        """
+        Reload the devices and rebuild the indexes.
+
+        Raise FortiManagerJSONError on error, the previous inventory is kept.
+        """
+        with self._lock:
+            devices = list(
+                self._fmg.iter_get("dvmdb/device", self._page_size, loadsub=1)
+            )
+            indexes = {
+                "name": {},
+                "sn": {},
+                "ip": {},
+                "devid": {},
+                "adom": {},
+                "device_adoms": {},
+            }
+            for device in devices:
+                for key in ("name", "sn", "ip"):
+                    if device.get(key):
+                        indexes[key][device[key]] = device
+                for vdom in device.get("vdom") or []:
+                    if vdom.get("devid"):
+                        indexes["devid"][vdom["devid"]] = device
+            if self._adoms:
+                self._load_adoms(indexes)
+            self._indexes = indexes
+            self._loaded = time.time()
+
+    def _load_adoms(self, indexes):
+        adoms = [
+            adom["name"]
+            for adom in self._fmg.iter_get(
+                "dvmdb/adom", self._page_size, fields=["name"]
+            )
+        ]
+        batch = self._fmg.batch()
+        for adom in adoms:
+            batch.get("dvmdb/adom/" + str(adom) + "/device", {"fields": ["name"]})
+        for adom, (status, members) in zip(adoms, batch.commit()):
+            devices = []
+            if status.get("code") == 0 and isinstance(members, list):
+                for member in members:
+                    device = indexes["name"].get(member.get("name"))
+                    if device is not None:
+                        devices.append(device)
+                        indexes["device_adoms"].setdefault(device["name"], [])
+                        indexes["device_adoms"][device["name"]].append(adom)
+            indexes["adom"][adom] = devices
+
+    def _index(self, name):
+        if self._indexes is None or (
+            self._ttl is not None and time.time() - self._loaded > self._ttl
+        ):
+            self.refresh()
+        return self._indexes[name]
+
+    def __len__(self):
+        return len(self._index("name"))
+
+    def __iter__(self):
+        return iter(list(self._index("name").values()))
+
+    def by_name(self, name):
+        return self._index("name").get(name)
+
+    def by_sn(self, sn):
+        return self._index("sn").get(sn)
+
+    def by_ip(self, ip):
+        return self._index("ip").get(ip)
+
+    def by_devid(self, devid):
+        return self._index("devid").get(devid)
+
+    def in_adom(self, adom):
+        return list(self._index("adom").get(adom, []))
+
+    def adom_of(self, name):
+        """
+        Return the ADOM names the device belongs to.
+        """
+        return list(self._index("device_adoms").get(name, []))
@@ -10,10 +10,24 @@ A Python module to access the FortiManager/FortiAnalyzer JSON API
 
 import time
 import logging
+import threading
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import sys
 
+from .codec import get_codec
+from .compression import get_compression
+from .fmg_batch import FortiManagerJSONBatch
+from .fmg_cache import ResponseCache, WRITE_METHODS
+from .fmg_compact import CompactTable
+from .hooks import JSONPrinter, first_url
+from .jsonstream import JSONStreamParser
+
 if sys.version_info >= (2, 7):
     logging.captureWarnings(True)
 else:
@@ -21,44 +35,210 @@ else:
 
     requests.packages.urllib3.disable_warnings()
 
+# Per-call options are kept per thread/asyncio task so that one logged-in
+# client can be shared: {client: {option: value}}
+_call_options = contextvars.ContextVar("fmg_call_options", default={})
+_pending_params = contextvars.ContextVar("fmg_pending_params", default={})
+
+# Status of the tasks still running when taskwait/taskwait_many give up
+TASK_TIMEOUT = {"code": -1, "message": "timeout"}
+
+
+class FortiManagerJSONError(Exception):
+    """
+    Error raised by the FortiManagerJSON iterators, which cannot return a
+    status. The status dict (or the transport exception) is in .status
+    """
+
+    def __init__(self, url, status):
+        super(FortiManagerJSONError, self).__init__("{}: {}".format(url, status))
+        self.url = url
+        self.status = status
+
+
+class StreamedResponse(object):
+    """
+    Response of FortiManagerJSON.get_stream(), iterate over it to get the
+    entries as they are decoded from the socket.
+
+    status is set once the iteration is finished. A status code other than 0
+    (or a transport error) raises FortiManagerJSONError at the end of the
+    iteration, after the entries already received.
+    """
+
+    def __init__(self, fmg, method, params, options, chunk_size):
+        self._fmg = fmg
+        self._method = method
+        self._params = params
+        self._options = options
+        self._chunk_size = chunk_size
+        self._response = None
+        self.url = params[0].get("url")
+        self.status = None
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+    def __iter__(self):
+        fmg = self._fmg
+        datagram = fmg._datagram(self._method, self._params, self._options)
+        parser = None
+        error = None
+        start = time.perf_counter()
+        try:
+            self._response = fmg._post_stream(datagram, self._options)
+            parser = JSONStreamParser(self._response.iter_content(self._chunk_size))
+            for index, entry in parser.items():
+                self.count += 1
+                yield entry
+        except (requests.exceptions.RequestException, ValueError) as err:
+            error = err
+        finally:
+            self.close()
+
+        if fmg._hooks["response"]:
+            info = {"elapsed": time.perf_counter() - start, "entries": self.count}
+            if error is None:
+                info["response"] = parser.envelope
+            else:
+                info["error"] = error
+            fmg._trace("response", datagram, **info)
+
+        if error is not None:
+            raise FortiManagerJSONError(self.url, error)
+        assert parser.envelope.get("id") == datagram["id"]
+        results = parser.envelope.get("result") or [{}]
+        self.status = results[0].get("status", {})
+        if self.status.get("code") != 0:
+            raise FortiManagerJSONError(self.url, self.status)
+
+
 class FortiManagerJSON(object):
     """
     FortiManagerJSON class
     """
     def __init__(self):
         self._reqid = 1
+        self._reqid_lock = threading.Lock()
         self._sid = None
         self._url = None
+        self._user = None
         self._ssl_verify = False
         self._debug = False
         self._http_debug = False
         self._bbcode = False
         self._ws_mode = False
-        self._params = False
         self._skip = False
         self._verbose = False
         self._root = False
         self._rootpath = None
         self._timeout = None
+        self._pool_connections = 10
+        self._pool_maxsize = 10
+        self._pool_block = False
+        self._max_retries = 0
+        self._keepalive = True
+        self._session = self._new_session()
+        self._hooks = {"request": [], "response": []}
+        self._printer = JSONPrinter()
+        self._codec = get_codec()
+        self._compression = None
+        self._cache = None
+        self._inventory = None
+
+    def _new_session(self):
+        # One requests.Session per client: every verb method goes through the
+        # same urllib3 connection pool, so TCP connections and TLS sessions
+        # are reused instead of being negotiated on every JSON-RPC call.
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self._pool_connections,
+            pool_maxsize=self._pool_maxsize,
+            pool_block=self._pool_block,
+            max_retries=self._max_retries,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if self._keepalive:
+            session.headers.update({"connection": "keep-alive"})
+        else:
+            session.headers.update({"connection": "close"})
+        return session
+
+    def pool(
+        self, connections=None, maxsize=None, block=None, retries=None, keepalive=None
+    ):
+        """
+        Configure the HTTP connection pool shared by all requests.
+
+        connections: number of per-host pools to keep
+        maxsize: maximum number of connections kept per host
+        block: wait for a free connection instead of opening extra ones
+        retries: number of retries on connection errors
+        keepalive: keep connections open between requests
+        """
+        if connections is not None:
+            self._pool_connections = connections
+        if maxsize is not None:
+            self._pool_maxsize = maxsize
+        if block is not None:
+            self._pool_block = block
+        if retries is not None:
+            self._max_retries = retries
+        if keepalive is not None:
+            self._keepalive = keepalive
+        self._session.close()
+        self._session = self._new_session()
+
+    def close(self):
+        self._session.close()
 
     def jprint(self, json_obj):
         return json.dumps(json_obj, indent=2, sort_keys=True)
 
     def dprint(self, msg, str):
-        if self._bbcode:
-            msg = "[color=#008080][b]" + msg + "[/b][/color]"
-            str = "[code]" + self.jprint(str) + "[/code]"
-        else:
-            str = self.jprint(str)
         if self._debug:
-            print(msg)
-            print(str)
+            self._printer.dprint(msg, str)
+
+    def hook(self, event, callback):
+        """
+        Register callback(info) for the "request" or "response" event.
+
+        See ftntlib.hooks for the content of info.
+        """
+        if callback not in self._hooks[event]:
+            self._hooks[event] = self._hooks[event] + [callback]
+
+    def unhook(self, event, callback):
+        self._hooks[event] = [hook for hook in self._hooks[event] if hook != callback]
+
+    def _trace(self, event, datagram, **info):
+        info["id"] = datagram.get("id")
+        info["method"] = datagram.get("method")
+        info["url"] = first_url(datagram)
+        info["datagram"] = datagram
+        for callback in self._hooks[event]:
+            callback(info)
 
     def debug(self, status):
         if status == "on":
             self._debug = True
+            self.hook("request", self._printer.request)
+            self.hook("response", self._printer.response)
         if status == "off":
             self._debug = False
+            self.unhook("request", self._printer.request)
+            self.unhook("response", self._printer.response)
 
     def http_debug(self, status):
         if status == "on":
@@ -71,6 +251,7 @@ class FortiManagerJSON(object):
             self._bbcode = True
         if status == "off":
             self._bbcode = False
+        self._printer.bbcode = self._bbcode
 
     def skip(self, status):
         if status == "on":
@@ -94,13 +275,163 @@ class FortiManagerJSON(object):
             self._root = False
 
     def params(self, params):
+        # Extra params for the next request made by this thread/asyncio task
         if params:
-            self._params = params
+            pending = dict(_pending_params.get())
+            pending[self] = params
+            _pending_params.set(pending)
 
     def timeout(self, timeout):
         if timeout:
             self._timeout = timeout
 
+    def codec(self, codec):
+        """
+        Select the JSON codec: "auto", "json", "orjson" or a codec object.
+        """
+        self._codec = get_codec(codec)
+
+    def compression(self, status, **settings):
+        """
+        Compress the request bodies and negotiate compressed responses.
+
+        status: "on" (settings: encoding, threshold, level, accept, see
+                compression.Compression), "off" or a Compression instance
+        """
+        self._compression = get_compression(self._compression, status, **settings)
+
+    def compression_stats(self):
+        if self._compression is None:
+            return None
+        return self._compression.stats()
+
+    def cache(self, status, ttl=60, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        """
+        Enable ("on") or disable ("off") the get response cache.
+
+        A ResponseCache instance can also be given, e.g. to share it between
+        clients: entries are keyed by FortiManager and user, so clients only
+        share the responses they would all get.
+
+        Return the cache (None when disabled), its hits/misses counters are
+        available with stats().
+        """
+        if status == "on":
+            self._cache = ResponseCache(ttl, max_entries, max_bytes)
+        elif status == "off":
+            self._cache = None
+        elif isinstance(status, ResponseCache):
+            self._cache = status
+        return self._cache
+
+    def inventory(self, inventory):
+        """
+        Use a DeviceInventory for the device lookups of get_devid() and
+        promote_device() (None to query the FortiManager each time).
+        """
+        self._inventory = inventory
+
+    def _cache_lookup(self, method, params, options):
+        # Return (key, cached result), key is None when not cacheable
+        if method != "get" or len(params) != 1:
+            return None, None
+        entry = dict(params[0])
+        if options["params"]:
+            entry.update(options["params"])
+        key = self._cache.key(
+            entry, options["root"], options["verbose"], (self._url, self._user)
+        )
+        cached = self._cache.get(key)
+        if cached is None:
+            return key, None
+        status, data = self._codec.loads(cached)
+        return key, (status, data)
+
+    def _cache_store(self, key, result):
+        if key is not None and result[0].get("code") == 0:
+            self._cache.put(key, self._codec.dumps(result))
+
+    def _cache_invalidate(self, method, params):
+        if method in WRITE_METHODS:
+            for entry in params:
+                self._cache.invalidate(entry.get("url", ""))
+
+    @contextlib.contextmanager
+    def options(self, **options):
+        """
+        Override per-call options inside a with block.
+
+        The overrides only apply to the calls made by the current thread (or
+        asyncio task), other users of the same client are not affected:
+
+            with fmg.options(root="global", verbose=1, timeout=30):
+                fmg.get(url)
+
+        root: root path, or False to disable chroot()
+        skip: skip value, or False to not send it
+        verbose: verbose value
+        params: extra params merged in the first params entry
+        timeout: HTTP timeout in seconds
+        """
+        current = _call_options.get()
+        merged = dict(current.get(self, {}))
+        merged.update(options)
+        scoped = dict(current)
+        scoped[self] = merged
+        token = _call_options.set(scoped)
+        try:
+            yield self
+        finally:
+            _call_options.reset(token)
+
+    def _next_reqid(self):
+        with self._reqid_lock:
+            reqid = self._reqid
+            self._reqid += 1
+        return reqid
+
+    def _resolve_options(self, options=None, pending=True):
+        resolved = {
+            "root": self._rootpath if self._root else False,
+            "skip": self._skip,
+            "verbose": self._verbose,
+            "params": False,
+            "timeout": self._timeout,
+        }
+        # Calls giving their own params leave the pending ones to the next call
+        if pending and not (options and "params" in options):
+            params = _pending_params.get()
+            if self in params:
+                resolved["params"] = params[self]
+                params = dict(params)
+                del params[self]
+                _pending_params.set(params)
+        resolved.update(_call_options.get().get(self, {}))
+        if options:
+            resolved.update(options)
+        return resolved
+
+    def _datagram_options(self, datagram, options):
+        if options["skip"] is not False:
+            datagram["skip"] = int(options["skip"])
+        if options["verbose"]:
+            datagram["verbose"] = int(options["verbose"])
+        if options["root"]:
+            datagram["root"] = options["root"]
+
+    def _datagram(self, method, params, options):
+        if options["params"]:
+            params[0].update(options["params"])
+        datagram = {
+            "id": self._next_reqid(),
+            "jsonrpc": "1.0",
+            "session": self._sid,
+            "method": method,
+            "params": params,
+        }
+        self._datagram_options(datagram, options)
+        return datagram
+
     def workspace_mode(self, status):
         if status == "auto":
             self._ws_mode = self._detect_ws_mode()
@@ -113,45 +444,59 @@ class FortiManagerJSON(object):
         else:
             pass  # to do: warn
 
-    def http_request(self, method, params):
+    def _exchange(self, method, params, options=None):
+        options = self._resolve_options(options)
+        datagram = self._datagram(method, params, options)
+        return self._post(datagram, options)
+
+    def _post(self, datagram, options):
         headers = {"content-type": "application/json"}
-        if self._params:
-            params[0].update(self._params)
-            self._params = False
-        datagram = {
-            "id": self._reqid,
-            "jsonrpc": "1.0",
-            "session": self._sid,
-            "method": method,
-            "params": params,
-        }
-        if self._skip is not False:
-            datagram["skip"] = int(self._skip)
-        if self._verbose:
-            datagram["verbose"] = int(self._verbose)
-        if self._root:
-            datagram["root"] = self._rootpath
+        body = self._codec.dumps(datagram)
+        if self._compression is not None:
+            body = self._compression.encode(body, headers)
 
-        self.dprint("REQUEST:", datagram)
+        if self._hooks["request"]:
+            self._trace("request", datagram, bytes=len(body))
 
+        response = None
+        error = None
+        start = time.perf_counter()
         try:
-            response = requests.post(
+            response = self._session.post(
                 self._url,
-                data=json.dumps(datagram),
+                data=body,
                 headers=headers,
                 verify=self._ssl_verify,
-                timeout=self._timeout,
+                timeout=options["timeout"],
             )
             response.raise_for_status()
-            response_json = response.json()
+            response_json = self._codec.loads(response.content)
+            if self._compression is not None:
+                self._compression.received(response)
         except requests.exceptions.ConnectionError as cerr:
             print("Connection ERROR: ", cerr)
-            return cerr
+            error = cerr
         except Exception as err:
             print("ERROR: ", err)
-            return err
+            error = err
+
+        if self._hooks["response"]:
+            info = {"elapsed": time.perf_counter() - start}
+            if response is not None:
+                info["status_code"] = response.status_code
+                info["bytes"] = len(response.content)
+            else:
+                info["status_code"] = None
+                info["bytes"] = 0
+            if error is None:
+                info["response"] = response_json
+            else:
+                info["error"] = error
+            self._trace("response", datagram, **info)
+
+        if error is not None:
+            return error
         assert response_json["id"] == datagram["id"]
-        self.dprint("RESPONSE:", response_json)
 
         if self._http_debug:
             print("{}".format(response.status_code))
@@ -159,7 +504,69 @@ class FortiManagerJSON(object):
             for key, value in headers.iteritems():
                 print(key + ": " + value)
 
-        return self.response(response_json)
+        return response_json
+
+    def _post_stream(self, datagram, options):
+        headers = {"content-type": "application/json"}
+        body = self._codec.dumps(datagram)
+        if self._compression is not None:
+            body = self._compression.encode(body, headers)
+
+        if self._hooks["request"]:
+            self._trace("request", datagram, bytes=len(body))
+
+        response = self._session.post(
+            self._url,
+            data=body,
+            headers=headers,
+            verify=self._ssl_verify,
+            timeout=options["timeout"],
+            stream=True,
+        )
+        response.raise_for_status()
+        return response
+
+    def http_request(self, method, params, options=None):
+        cache = self._cache
+        key = None
+        if cache is not None:
+            options = self._resolve_options(options)
+            key, cached = self._cache_lookup(method, params, options)
+            if cached is not None:
+                return cached
+        response_json = self._exchange(method, params, options)
+        if cache is not None:
+            self._cache_invalidate(method, params)
+        if isinstance(response_json, Exception):
+            return response_json
+        result = self.response(response_json)
+        if key is not None:
+            self._cache_store(key, result)
+        return result
+
+    def http_request_list(self, method, params, options=None):
+        """
+        Send all entries of params in a single datagram.
+
+        Return one (status, data) tuple per params entry, in order.
+        """
+        response_json = self._exchange(method, params, options)
+        if self._cache is not None:
+            self._cache_invalidate(method, params)
+        if isinstance(response_json, Exception):
+            return response_json
+        return self.responses(response_json)
+
+    def _result(self, result):
+        status = {"code": 0}
+        data = {}
+        if "status" in result:
+            status = result["status"]
+        else:
+            status["message"] = "Did not receive status from host."
+        if "data" in result:
+            data = result["data"]
+        return status, data
 
     def response(self, response):
         status = {"code": 0}
@@ -172,24 +579,40 @@ class FortiManagerJSON(object):
                 result = response["result"][0]
             else:
                 result = response["result"]
-            if "status" in result:
-                status = result["status"]
-            else:
-                status["message"] = "Did not receive status from host."
-            if "data" in result:
-                data = result["data"]
-            return status, data
+            return self._result(result)
         except Exception as e:
             print("Response parser error: (%s) %s", type(e), e)
             status["code"] = 1
             status["message"] = "Response parser error"
             return status, data
 
+    def responses(self, response):
+        try:
+            if self._sid == None and "session" in response:
+                self._sid = response["session"]
+            if type(response["result"]) is list:
+                results = response["result"]
+            else:
+                results = [response["result"]]
+            return [self._result(result) for result in results]
+        except Exception as e:
+            print("Response parser error: (%s) %s", type(e), e)
+            return [({"code": 1, "message": "Response parser error"}, {})]
+
+    def batch(self, chunk_size=100):
+        """
+        Return a FortiManagerJSONBatch collecting calls for this session.
+
+        chunk_size: maximum number of params entries sent per datagram
+        """
+        return FortiManagerJSONBatch(self, chunk_size)
+
     def login(self, ip, user, passwd, ssl=True):
         if ssl:
             self._url = "https://" + ip + "/jsonrpc"
         else:
             self._url = "http://" + ip + "/jsonrpc"
+        self._user = user
 
         params = [
             {"url": "/sys/login/user", "data": [{"passwd": passwd, "user": user}]}
@@ -206,10 +629,8 @@ class FortiManagerJSON(object):
         return status, response
 
     def _do(self, method, url, data={}):
-        store = {"root": self._root, "skip": self._skip, "verbose": self._verbose}
-        self._root = False
-        self._skip = False
-        self._verbose = False
+        # Helper calls never use the chroot/skip/verbose settings
+        options = {"root": False, "skip": False, "verbose": False}
         if method == "get" or method == "move":
             if data:
                 data["url"] = url
@@ -220,46 +641,20 @@ class FortiManagerJSON(object):
             params = [{"url": url}]
             if data:
                 params[0]["data"] = data
-        status, response = self.http_request(method, params)
-        self._root = store["root"]
-        self._skip = store["skip"]
-        self._verbose = store["verbose"]
+        status, response = self.http_request(method, params, options)
         return status, response
 
-    def do(self, method, params):
-        status, response = self.http_request(method, params)
+    def do(self, method, params, options=None):
+        status, response = self.http_request(method, params, options)
         return status, response
 
     def baredo(self, datagram):
-        headers = {"content-type": "application/json"}
-
-        if self._skip is not False:
-            datagram["skip"] = int(self._skip)
-        if self._verbose:
-            datagram["verbose"] = int(self._verbose)
-        if self._root:
-            datagram["root"] = self._rootpath
-
-        self.dprint("REQUEST:", datagram)
-
-        try:
-            response = requests.post(
-                self._url,
-                data=json.dumps(datagram),
-                headers=headers,
-                verify=self._ssl_verify,
-                timeout=self._timeout,
-            )
-            response = response.json()
-        except requests.exceptions.ConnectionError as cerr:
-            print("Connection ERROR: ", cerr)
-            return cerr
-        except Exception as err:
-            print("ERROR: ", err)
-            return err
-        assert response["id"] == datagram["id"]
-        self.dprint("RESPONSE:", response)
-        return self.response(response)
+        options = self._resolve_options(pending=False)
+        self._datagram_options(datagram, options)
+        response_json = self._post(datagram, options)
+        if isinstance(response_json, Exception):
+            return response_json
+        return self.response(response_json)
 
     def get(self, url, data={}):
         if data:
@@ -270,6 +665,151 @@ class FortiManagerJSON(object):
         status, response = self.http_request("get", params)
         return status, response
 
+    def get_page(self, url, offset, limit, data=None):
+        """
+        Get entries [offset, offset + limit[ of a table using the range option.
+
+        Raise FortiManagerJSONError on error.
+        """
+        params = dict(data) if data else {}
+        params["url"] = url
+        params["range"] = [offset, limit]
+        options = {"root": False, "skip": False, "verbose": False}
+        response = self.http_request("get", [params], options)
+        if isinstance(response, Exception):
+            raise FortiManagerJSONError(url, response)
+        status, page = response
+        if status.get("code") != 0:
+            raise FortiManagerJSONError(url, status)
+        return page
+
+    def iter_get(self, url, page_size=1000, data=None, **options):
+        """
+        Iterate over the entries of a table, fetching page_size entries per
+        request with the range option.
+
+        The get options (fields, filter, loadsub...) are given as keyword
+        arguments, or in data for the names which are not valid identifiers
+        (e.g. "expand member"). Raise FortiManagerJSONError on error.
+        """
+        data = dict(data) if data else {}
+        data.update(options)
+        offset = 0
+        while True:
+            page = self.get_page(url, offset, page_size, data)
+            if not isinstance(page, list):
+                if page:
+                    yield page
+                return
+            for entry in page:
+                yield entry
+            if len(page) < page_size:
+                return
+            offset += len(page)
+
+    def get_compact(self, url, page_size=1000, data=None, **options):
+        """
+        Get a table as a CompactTable: columnar and dictionary-encoded, the
+        values are decoded on access. Only one page of entries is held as
+        dicts at a time.
+
+        Same arguments as iter_get(). Raise FortiManagerJSONError on error.
+        """
+        rows = self.iter_get(url, page_size, data, **options)
+        return CompactTable(rows, self._codec).freeze()
+
+    def get_stream(self, url, data=None, chunk_size=65536, **options):
+        """
+        Get url and return a StreamedResponse yielding the entries of the
+        response data as they are received and decoded.
+
+        The body is decoded incrementally with the json module (whatever
+        the codec), so neither the whole body nor the whole list of entries
+        is held in memory:
+
+            response = fmg.get_stream("dvmdb/device", loadsub=1)
+            for device in response:
+                ...
+            response.status
+
+        The get options are given as in iter_get().
+        """
+        params = dict(data) if data else {}
+        params.update(options)
+        params["url"] = url
+        options = self._resolve_options()
+        return StreamedResponse(self, "get", [params], options, chunk_size)
+
+    def count(self, url, data=None):
+        """
+        Return the number of entries of a table (get "count" option).
+
+        Raise FortiManagerJSONError on error.
+        """
+        params = dict(data) if data else {}
+        for option in ("fields", "range", "loadsub"):
+            params.pop(option, None)
+        params["url"] = url
+        params["option"] = "count"
+        options = {"root": False, "skip": False, "verbose": False}
+        response = self.http_request("get", [params], options)
+        if isinstance(response, Exception):
+            raise FortiManagerJSONError(url, response)
+        status, count = response
+        if status.get("code") != 0:
+            raise FortiManagerJSONError(url, status)
+        return int(count)
+
+    def iter_get_sharded(
+        self, url, shard_size=1000, workers=4, data=None, sessions=None, **options
+    ):
+        """
+        Iterate over the entries of a table, fetching range shards concurrently.
+
+        The table is counted first, then split in shards of shard_size
+        entries fetched by workers threads, over this client connection pool
+        (size it with pool(maxsize=workers)) or over the sessions of a
+        JSONSessionPool. Entries are yielded in server order; at most
+        2 * workers shards are held in memory.
+
+        Options are the same as for iter_get().
+        """
+        data = dict(data) if data else {}
+        data.update(options)
+        count = self.count(url, data)
+
+        def fetch(offset):
+            if sessions is None:
+                return self.get_page(url, offset, shard_size, data)
+            with sessions.checkout() as client:
+                return client.get_page(url, offset, shard_size, data)
+
+        offsets = collections.deque(range(0, count, shard_size))
+        pending = collections.deque()
+        page = []
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            try:
+                while offsets or pending:
+                    while offsets and len(pending) < 2 * workers:
+                        pending.append(executor.submit(fetch, offsets.popleft()))
+                    page = pending.popleft().result()
+                    for entry in page:
+                        yield entry
+            finally:
+                for future in pending:
+                    future.cancel()
+
+        # Entries added after the count are read sequentially
+        if count and len(page) == shard_size:
+            offset = count
+            while True:
+                page = self.get_page(url, offset, shard_size, data)
+                for entry in page:
+                    yield entry
+                if len(page) < shard_size:
+                    break
+                offset += len(page)
+
     def add(self, url, data={}):
         params = [{"url": url}]
         if data:
@@ -332,21 +872,73 @@ class FortiManagerJSON(object):
         status, response = self.http_request("exec", params)
         return status, response
 
-    def taskwait(self, taskid):
-        url = "task/task/" + str(taskid)
-        wait = 0
-        interval = 5
-        timeout = 120
-        while wait < timeout:
-            status, response = self._do("get", url)
-            if status["code"] == 0:
-                if response["percent"] == 100:
-                    return status, response
-                else:
-                    time.sleep(interval)
-                    wait = wait + interval
+    def taskwait(self, taskid, timeout=120, interval=0.5, max_interval=5, backoff=1.5):
+        """
+        Wait for task/task/<taskid> to reach 100%.
+
+        The poll interval starts at interval seconds and grows by backoff up
+        to max_interval. After timeout seconds (None to wait forever) the
+        status is {"code": -1, "message": "timeout"} and the response is the
+        last polled one.
+        """
+        for _, status, response in self.taskwait_many(
+            [taskid], timeout, interval, max_interval, backoff
+        ):
+            return status, response
+
+    def taskwait_many(
+        self,
+        taskids,
+        timeout=None,
+        interval=0.5,
+        max_interval=5,
+        backoff=1.5,
+        chunk_size=100,
+    ):
+        """
+        Wait for several tasks, polling all of them with one request per cycle.
+
+        Yield (taskid, status, response) as soon as each task is finished (or
+        failed). When timeout is reached, the unfinished tasks are yielded with
+        the status {"code": -1, "message": "timeout"} and their last polled
+        response.
+        """
+        pending = {}
+        for taskid in taskids:
+            pending[taskid] = ({"code": 1, "message": "Task not polled"}, {})
+        deadline = None if timeout is None else time.time() + timeout
+        while pending:
+            for taskid, result in self._task_status(list(pending), chunk_size):
+                pending[taskid] = result
+                status, response = result
+                if status.get("code") != 0 or response.get("percent") == 100:
+                    del pending[taskid]
+                    yield taskid, status, response
+            if not pending:
+                break
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                for taskid, (_, response) in list(pending.items()):
+                    yield taskid, dict(TASK_TIMEOUT), response
+                return
+            if deadline is None:
+                time.sleep(interval)
             else:
-                return status, response
+                time.sleep(min(interval, deadline - now))
+            interval = min(interval * backoff, max_interval)
+
+    def _task_status(self, taskids, chunk_size):
+        # Polls leave the pending params() to the caller's next request
+        options = {"root": False, "skip": False, "verbose": False, "params": False}
+        for start in range(0, len(taskids), chunk_size):
+            chunk = taskids[start : start + chunk_size]
+            params = [{"url": "task/task/" + str(taskid)} for taskid in chunk]
+            response = self.http_request_list("get", params, options)
+            if isinstance(response, Exception):
+                # Transient error, the tasks are polled again next cycle
+                continue
+            for taskid, result in zip(chunk, response):
+                yield taskid, result
 
     # Package methods
 
@@ -364,6 +956,11 @@ class FortiManagerJSON(object):
     # Device methods
 
     def get_devid(self, devicename):
+        if self._inventory is not None:
+            device = self._inventory.by_name(devicename)
+            if device is not None:
+                vdoms = device.get("vdom") or [{}]
+                return vdoms[0].get("devid") or 1
         url = "dvmdb/device/" + str(devicename)
         code, device = self._do("get", url, {"loadsub": 1})
         if device["data"]["vdom"][0]["devid"]:
@@ -510,11 +1107,19 @@ class FortiManagerJSON(object):
         return status, response
 
     def promote_device(self, adom, devicename, username, password):
-        c, r = self._do(
-            "get", "dvmdb/device/" + str(devicename), {"filter": ["mgmt_mode", "==", 0]}
-        )
-        if c != 0:
-            return c, r
+        device = None
+        if self._inventory is not None:
+            device = self._inventory.by_name(devicename)
+        if device is not None and device.get("mgmt_mode") == 0:
+            r = {"data": device}
+        else:
+            c, r = self._do(
+                "get",
+                "dvmdb/device/" + str(devicename),
+                {"filter": ["mgmt_mode", "==", 0]},
+            )
+            if c != 0:
+                return c, r
         url = "dvm/cmd/promote/dev-list"
         object = {
             "flags": r["data"]["flags"],
@@ -0,0 +1,772 @@
+# coding: utf-8
+
+"""
+fmg_jsonapi_async.py
+
+An asyncio flavour of fmg_jsonapi.py built on aiohttp.
+
+FortiManagerJSONAsync keeps the method surface of FortiManagerJSON but every
+method doing a JSON-RPC call is a coroutine:
+
+    fmg = FortiManagerJSONAsync()
+    await fmg.login(ip, user, passwd)
+    status, data = await fmg.get("dvmdb/adom")
+    await fmg.logout()
+    await fmg.close()
+"""
+
+import asyncio
+import collections
+import time
+
+import aiohttp
+
+from .fmg_batch import FortiManagerJSONBatch
+from .fmg_compact import CompactTable
+from .fmg_jsonapi import FortiManagerJSON, FortiManagerJSONError, TASK_TIMEOUT
+from .jsonstream import NEED_DATA, JSONStreamParser
+
+
+class FortiManagerJSONAsyncBatch(FortiManagerJSONBatch):
+    """
+    FortiManagerJSONBatch for FortiManagerJSONAsync, used with "async with".
+    """
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.commit()
+        else:
+            self._entries = []
+        return False
+
+    async def commit(self):
+        results = []
+        for method, chunk in self._chunks():
+            response = await self._fmg.http_request_list(method, chunk)
+            results.extend(self._chunk_results(chunk, response))
+        self.results.extend(results)
+        return results
+
+
+class AsyncStreamedResponse(object):
+    """
+    Response of FortiManagerJSONAsync.get_stream(), iterate over it with
+    "async for" to get the entries as they are decoded from the socket.
+
+    status is set once the iteration is finished. A status code other than 0
+    (or a transport error) raises FortiManagerJSONError at the end of the
+    iteration, after the entries already received.
+    """
+
+    def __init__(self, fmg, method, params, options, chunk_size):
+        self._fmg = fmg
+        self._method = method
+        self._params = params
+        self._options = options
+        self._chunk_size = chunk_size
+        self._response = None
+        self.url = params[0].get("url")
+        self.status = None
+        self.count = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        if self._response is not None:
+            self._response.release()
+            self._response = None
+
+    async def __aiter__(self):
+        fmg = self._fmg
+        datagram = fmg._datagram(self._method, self._params, self._options)
+        parser = JSONStreamParser()
+        error = None
+        start = time.perf_counter()
+        try:
+            async with fmg._get_semaphore():
+                self._response = await fmg._post_stream(datagram, self._options)
+                content = self._response.content
+                for item in parser.parse():
+                    if item is NEED_DATA:
+                        chunk = await content.read(self._chunk_size)
+                        if chunk:
+                            parser.feed(chunk)
+                        else:
+                            parser.close()
+                    else:
+                        self.count += 1
+                        yield item[1]
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+            error = err
+        finally:
+            self.close()
+
+        if fmg._hooks["response"]:
+            info = {"elapsed": time.perf_counter() - start, "entries": self.count}
+            if error is None:
+                info["response"] = parser.envelope
+            else:
+                info["error"] = error
+            fmg._trace("response", datagram, **info)
+
+        if error is not None:
+            raise FortiManagerJSONError(self.url, error)
+        assert parser.envelope.get("id") == datagram["id"]
+        results = parser.envelope.get("result") or [{}]
+        self.status = results[0].get("status", {})
+        if self.status.get("code") != 0:
+            raise FortiManagerJSONError(self.url, self.status)
+
+
+class FortiManagerJSONAsync(FortiManagerJSON):
+    """
+    FortiManagerJSONAsync class
+    """
+
+    def __init__(self):
+        self._concurrency = 10
+        self._semaphore = None
+        super(FortiManagerJSONAsync, self).__init__()
+
+    def _new_session(self):
+        # The aiohttp session must be created from a running event loop, it is
+        # opened by the first request (see _get_session).
+        return None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self._pool_maxsize,
+                limit_per_host=self._pool_maxsize,
+                ssl=None if self._ssl_verify else False,
+                force_close=not self._keepalive,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    def _get_semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        return self._semaphore
+
+    def concurrency(self, concurrency):
+        """
+        Set the maximum number of JSON-RPC calls in flight for this client.
+        """
+        if concurrency:
+            self._concurrency = concurrency
+            self._semaphore = None
+
+    def pool(
+        self, connections=None, maxsize=None, block=None, retries=None, keepalive=None
+    ):
+        if connections is not None:
+            self._pool_connections = connections
+        if maxsize is not None:
+            self._pool_maxsize = maxsize
+        if block is not None:
+            self._pool_block = block
+        if retries is not None:
+            self._max_retries = retries
+        if keepalive is not None:
+            self._keepalive = keepalive
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+        return False
+
+    async def workspace_mode(self, status):
+        if status == "auto":
+            self._ws_mode = await self._detect_ws_mode()
+        else:
+            super(FortiManagerJSONAsync, self).workspace_mode(status)
+
+    async def _exchange(self, method, params, options=None):
+        options = self._resolve_options(options)
+        datagram = self._datagram(method, params, options)
+        return await self._post(datagram, options)
+
+    async def _post(self, datagram, options):
+        headers = {"content-type": "application/json"}
+        body = self._codec.dumps(datagram)
+        if self._compression is not None:
+            body = self._compression.encode(body, headers)
+
+        if self._hooks["request"]:
+            self._trace("request", datagram, bytes=len(body))
+
+        response = None
+        content = b""
+        error = None
+        start = time.perf_counter()
+        try:
+            async with self._get_semaphore():
+                async with self._get_session().post(
+                    self._url,
+                    data=body,
+                    headers=headers,
+                    timeout=aiohttp.ClientTimeout(total=options["timeout"]),
+                ) as response:
+                    response.raise_for_status()
+                    content = await response.read()
+                    response_json = self._codec.loads(content)
+                    if self._compression is not None:
+                        wire = response.content_length
+                        if wire is None and "Content-Encoding" not in response.headers:
+                            wire = len(content)
+                        # aiohttp only gives the decoded body, a chunked and
+                        # encoded response has no known wire size
+                        if wire is not None:
+                            self._compression.count(len(content), wire)
+        except aiohttp.ClientConnectionError as cerr:
+            print("Connection ERROR: ", cerr)
+            error = cerr
+        except Exception as err:
+            print("ERROR: ", err)
+            error = err
+
+        if self._hooks["response"]:
+            info = {
+                "elapsed": time.perf_counter() - start,
+                "status_code": response.status if response is not None else None,
+                "bytes": len(content),
+            }
+            if error is None:
+                info["response"] = response_json
+            else:
+                info["error"] = error
+            self._trace("response", datagram, **info)
+
+        if error is not None:
+            return error
+        assert response_json["id"] == datagram["id"]
+
+        if self._http_debug:
+            print("{}".format(response.status))
+            for key, value in response.request_info.headers.items():
+                print(key + ": " + value)
+
+        return response_json
+
+    async def _post_stream(self, datagram, options):
+        headers = {"content-type": "application/json"}
+        body = self._codec.dumps(datagram)
+        if self._compression is not None:
+            body = self._compression.encode(body, headers)
+
+        if self._hooks["request"]:
+            self._trace("request", datagram, bytes=len(body))
+
+        response = await self._get_session().post(
+            self._url,
+            data=body,
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=options["timeout"]),
+        )
+        try:
+            response.raise_for_status()
+        except aiohttp.ClientResponseError:
+            response.release()
+            raise
+        return response
+
+    async def http_request(self, method, params, options=None):
+        cache = self._cache
+        key = None
+        if cache is not None:
+            options = self._resolve_options(options)
+            key, cached = self._cache_lookup(method, params, options)
+            if cached is not None:
+                return cached
+        response_json = await self._exchange(method, params, options)
+        if cache is not None:
+            self._cache_invalidate(method, params)
+        if isinstance(response_json, Exception):
+            return response_json
+        result = self.response(response_json)
+        if key is not None:
+            self._cache_store(key, result)
+        return result
+
+    async def http_request_list(self, method, params, options=None):
+        response_json = await self._exchange(method, params, options)
+        if self._cache is not None:
+            self._cache_invalidate(method, params)
+        if isinstance(response_json, Exception):
+            return response_json
+        return self.responses(response_json)
+
+    def batch(self, chunk_size=100):
+        return FortiManagerJSONAsyncBatch(self, chunk_size)
+
+    async def login(self, ip, user, passwd, ssl=True):
+        if ssl:
+            self._url = "https://" + ip + "/jsonrpc"
+        else:
+            self._url = "http://" + ip + "/jsonrpc"
+        self._user = user
+
+        params = [
+            {"url": "/sys/login/user", "data": [{"passwd": passwd, "user": user}]}
+        ]
+
+        status, response = await self.http_request("exec", params)
+
+        return status, response
+
+    async def logout(self):
+        params = [{"url": "/sys/logout"}]
+        status, response = await self.http_request("exec", params)
+        self._sid = None
+        return status, response
+
+    async def _do(self, method, url, data={}):
+        options = {"root": False, "skip": False, "verbose": False}
+        if method == "get" or method == "move":
+            if data:
+                data["url"] = url
+                params = [data]
+            else:
+                params = [{"url": url}]
+        else:
+            params = [{"url": url}]
+            if data:
+                params[0]["data"] = data
+        status, response = await self.http_request(method, params, options)
+        return status, response
+
+    async def do(self, method, params, options=None):
+        status, response = await self.http_request(method, params, options)
+        return status, response
+
+    async def baredo(self, datagram):
+        options = self._resolve_options(pending=False)
+        self._datagram_options(datagram, options)
+        response_json = await self._post(datagram, options)
+        if isinstance(response_json, Exception):
+            return response_json
+        return self.response(response_json)
+
+    async def get(self, url, data={}):
+        if data:
+            data["url"] = url
+            params = [data]
+        else:
+            params = [{"url": url}]
+        status, response = await self.http_request("get", params)
+        return status, response
+
+    async def get_page(self, url, offset, limit, data=None):
+        params = dict(data) if data else {}
+        params["url"] = url
+        params["range"] = [offset, limit]
+        options = {"root": False, "skip": False, "verbose": False}
+        response = await self.http_request("get", [params], options)
+        if isinstance(response, Exception):
+            raise FortiManagerJSONError(url, response)
+        status, page = response
+        if status.get("code") != 0:
+            raise FortiManagerJSONError(url, status)
+        return page
+
+    async def iter_get(self, url, page_size=1000, data=None, **options):
+        data = dict(data) if data else {}
+        data.update(options)
+        offset = 0
+        while True:
+            page = await self.get_page(url, offset, page_size, data)
+            if not isinstance(page, list):
+                if page:
+                    yield page
+                return
+            for entry in page:
+                yield entry
+            if len(page) < page_size:
+                return
+            offset += len(page)
+
+    async def get_compact(self, url, page_size=1000, data=None, **options):
+        table = CompactTable(codec=self._codec)
+        async for entry in self.iter_get(url, page_size, data, **options):
+            table.append(entry)
+        return table.freeze()
+
+    def get_stream(self, url, data=None, chunk_size=65536, **options):
+        """
+        Get url and return an AsyncStreamedResponse yielding the entries of
+        the response data as they are received and decoded:
+
+            async with fmg.get_stream("dvmdb/device", loadsub=1) as response:
+                async for device in response:
+                    ...
+        """
+        params = dict(data) if data else {}
+        params.update(options)
+        params["url"] = url
+        options = self._resolve_options()
+        return AsyncStreamedResponse(self, "get", [params], options, chunk_size)
+
+    async def count(self, url, data=None):
+        params = dict(data) if data else {}
+        for option in ("fields", "range", "loadsub"):
+            params.pop(option, None)
+        params["url"] = url
+        params["option"] = "count"
+        options = {"root": False, "skip": False, "verbose": False}
+        response = await self.http_request("get", [params], options)
+        if isinstance(response, Exception):
+            raise FortiManagerJSONError(url, response)
+        status, count = response
+        if status.get("code") != 0:
+            raise FortiManagerJSONError(url, status)
+        return int(count)
+
+    async def iter_get_sharded(
+        self, url, shard_size=1000, workers=4, data=None, **options
+    ):
+        """
+        Async iterator over the entries of a table, fetching up to workers
+        range shards concurrently (within the concurrency() limit). Entries
+        are yielded in server order.
+        """
+        data = dict(data) if data else {}
+        data.update(options)
+        count = await self.count(url, data)
+        offsets = collections.deque(range(0, count, shard_size))
+        pending = collections.deque()
+        page = []
+        try:
+            while offsets or pending:
+                while offsets and len(pending) < workers:
+                    pending.append(
+                        asyncio.ensure_future(
+                            self.get_page(url, offsets.popleft(), shard_size, data)
+                        )
+                    )
+                page = await pending.popleft()
+                for entry in page:
+                    yield entry
+        finally:
+            for future in pending:
+                future.cancel()
+
+        # Entries added after the count are read sequentially
+        if count and len(page) == shard_size:
+            offset = count
+            while True:
+                page = await self.get_page(url, offset, shard_size, data)
+                for entry in page:
+                    yield entry
+                if len(page) < shard_size:
+                    break
+                offset += len(page)
+
+    async def _verb(self, method, url, data):
+        params = [{"url": url}]
+        if data:
+            params[0]["data"] = data
+        status, response = await self.http_request(method, params)
+        return status, response
+
+    async def add(self, url, data={}):
+        return await self._verb("add", url, data)
+
+    async def update(self, url, data={}):
+        return await self._verb("update", url, data)
+
+    async def set(self, url, data={}):
+        return await self._verb("set", url, data)
+
+    async def unset(self, url, data={}):
+        return await self._verb("unset", url, data)
+
+    async def delete(self, url, data={}):
+        return await self._verb("delete", url, data)
+
+    async def replace(self, url, data={}):
+        return await self._verb("replace", url, data)
+
+    async def clone(self, url, data={}):
+        return await self._verb("clone", url, data)
+
+    async def move(self, url, data):
+        data["url"] = url
+        params = [data]
+        status, response = await self.http_request("move", params)
+        return status, response
+
+    async def execute(self, url, data={}):
+        return await self._verb("exec", url, data)
+
+    async def taskwait(
+        self, taskid, timeout=120, interval=0.5, max_interval=5, backoff=1.5
+    ):
+        async for _, status, response in self.taskwait_many(
+            [taskid], timeout, interval, max_interval, backoff
+        ):
+            return status, response
+
+    async def taskwait_many(
+        self,
+        taskids,
+        timeout=None,
+        interval=0.5,
+        max_interval=5,
+        backoff=1.5,
+        chunk_size=100,
+    ):
+        # Polls leave the pending params() to the caller's next request
+        options = {"root": False, "skip": False, "verbose": False, "params": False}
+        pending = {}
+        for taskid in taskids:
+            pending[taskid] = ({"code": 1, "message": "Task not polled"}, {})
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while pending:
+            taskids = list(pending)
+            for start in range(0, len(taskids), chunk_size):
+                chunk = taskids[start : start + chunk_size]
+                params = [{"url": "task/task/" + str(taskid)} for taskid in chunk]
+                response = await self.http_request_list("get", params, options)
+                if isinstance(response, Exception):
+                    continue
+                for taskid, (status, data) in zip(chunk, response):
+                    pending[taskid] = (status, data)
+                    if status.get("code") != 0 or data.get("percent") == 100:
+                        del pending[taskid]
+                        yield taskid, status, data
+            if not pending:
+                break
+            now = loop.time()
+            if deadline is not None and now >= deadline:
+                for taskid, (_, data) in list(pending.items()):
+                    yield taskid, dict(TASK_TIMEOUT), data
+                return
+            if deadline is None:
+                await asyncio.sleep(interval)
+            else:
+                await asyncio.sleep(min(interval, deadline - now))
+            interval = min(interval * backoff, max_interval)
+
+    # Package methods
+
+    async def install_package(self, adom, package, scope, flags=["install_chg"]):
+        url = "securityconsole/install/package"
+        pkg = "adom/" + adom + "/pkg/" + package
+        data = {"adom": adom, "pkg": pkg, "flags": flags, "scope": scope}
+        code, resp = await self._do("exec", url, data)
+        if code == 0:
+            status, response = await self.taskwait(resp["data"]["task"])
+            return status, response
+        else:
+            return code, resp
+
+    # Device methods
+
+    async def _task(self, url, data):
+        status, response = await self._do("exec", url, data)
+        if response["data"]["taskid"]:
+            status, response = await self.taskwait(response["data"]["taskid"])
+        return status, response
+
+    async def get_devid(self, devicename):
+        if self._inventory is not None:
+            device = self._inventory.by_name(devicename)
+            if device is not None:
+                vdoms = device.get("vdom") or [{}]
+                return vdoms[0].get("devid") or 1
+        url = "dvmdb/device/" + str(devicename)
+        code, device = await self._do("get", url, {"loadsub": 1})
+        if device["data"]["vdom"][0]["devid"]:
+            return device["data"]["vdom"][0]["devid"]
+        else:
+            return 1
+
+    async def discover_device(self, ip, username, password):
+        url = "dvm/cmd/discover/device"
+        deviceinfo = {"ip": ip, "adm_usr": username, "adm_pass": password}
+        data = {"device": deviceinfo}
+        status, response = await self._do("exec", url, data)
+        return status, response
+
+    async def add_device(self, adom, ip, username, password, mgmtmode=3):
+        url = "dvm/cmd/add/device"
+        code, response = await self.discover_device(ip, username, password)
+        device = {}
+        if code == 0:
+            device = response["data"]["device"]
+        else:
+            return response
+        device["mgmt_mode"] = mgmtmode
+        data = {"adom": adom, "device": device, "flags": ["create_task", "nonblocking"]}
+        status, response = await self._do("exec", url, data)
+        if response["data"]["taskid"]:
+            status, response = await self.taskwait(response["data"]["taskid"])
+        else:
+            return status, response
+        ucode, ures = await self.update_device(adom, device["name"])
+        if ucode != 0:
+            return ucode, ures
+        rcode, rres = await self.reload_devlist(adom, {"name": device["name"]}, "dvm")
+        if rcode != 0:
+            return rcode, rres
+        return status, response
+
+    async def add_devlist(self, adom, deviceinfo):
+        url = "dvm/cmd/add/dev-list"
+        data = {
+            "adom": adom,
+            "add-dev-list": deviceinfo,
+            "flags": ["create_task", "nonblocking"],
+        }
+        return await self._task(url, data)
+
+    async def update_device(self, adom, devicename):
+        url = "dvm/cmd/update/device"
+        data = {
+            "adom": adom,
+            "device": devicename,
+            "flags": ["create_task", "nonblocking"],
+        }
+        return await self._task(url, data)
+
+    async def update_devlist(self, adom, devlist):
+        url = "dvm/cmd/update/dev-list"
+        data = {
+            "adom": adom,
+            "reload-dev-member-list": devlist,
+            "flags": ["create_task", "nonblocking"],
+        }
+        return await self._task(url, data)
+
+    async def reload_device(self, adom, devicename, frm="dvm"):
+        url = "dvm/cmd/reload/device"
+        data = {
+            "adom": adom,
+            "device": devicename,
+            "flags": ["create_task", "nonblocking"],
+            "tag": "Retrieved from JSON API",
+            "from": frm,
+        }
+        return await self._task(url, data)
+
+    async def reload_devlist(self, adom, devlist, frm="dvm"):
+        url = "dvm/cmd/reload/dev-list"
+        data = {
+            "adom": adom,
+            "reload-dev-member-list": devlist,
+            "flags": ["create_task", "nonblocking"],
+            "tag": "Retrieved from JSON API",
+            "from": frm,
+        }
+        return await self._task(url, data)
+
+    async def delete_device(self, adom, devicename):
+        url = "dvm/cmd/del/device"
+        data = {
+            "adom": adom,
+            "device": devicename,
+            "flags": ["create_task", "nonblocking"],
+        }
+        return await self._task(url, data)
+
+    async def delete_devlist(self, adom, deviceinfo):
+        url = "dvm/cmd/del/dev-list"
+        data = {
+            "adom": adom,
+            "del-dev-member-list": deviceinfo,
+            "flags": ["create_task", "nonblocking"],
+        }
+        return await self._task(url, data)
+
+    async def get_unreg_devices(self):
+        url = "dvmdb/device"
+        data = {"loadsub": 0, "filter": ["mgmt_mode", "==", 0]}
+        status, response = await self._do("get", url, data)
+        return status, response
+
+    async def promote_device(self, adom, devicename, username, password):
+        device = None
+        if self._inventory is not None:
+            device = self._inventory.by_name(devicename)
+        if device is not None and device.get("mgmt_mode") == 0:
+            r = {"data": device}
+        else:
+            c, r = await self._do(
+                "get",
+                "dvmdb/device/" + str(devicename),
+                {"filter": ["mgmt_mode", "==", 0]},
+            )
+            if c != 0:
+                return c, r
+        url = "dvm/cmd/promote/dev-list"
+        object = {
+            "flags": r["data"]["flags"],
+            "ip": r["data"]["ip"],
+            "sn": r["data"]["sn"],
+            "oid": r["data"]["vdom"][0]["devid"],
+            "adm_usr": username,
+            "adm_pass": password,
+        }
+        data = {
+            "adom": adom,
+            "add-dev-list": [object],
+            "flags": ["create_task", "nonblocking"],
+        }
+        return await self._task(url, data)
+
+    # Workspace methods
+
+    async def _detect_ws_mode(self):
+        url = "cli/global/system/global"
+        code, response = await self._do("get", url)
+        return response["data"]["workspace-mode"]
+
+    async def _workspace(self, adom, action, pkgpath=False):
+        if pkgpath:
+            url = (
+                "pm/config/adom/"
+                + str(adom)
+                + "/_workspace/"
+                + str(action)
+                + "/"
+                + str(pkgpath)
+            )
+        else:
+            url = "pm/config/adom/" + str(adom) + "/_workspace/" + str(action)
+        status, response = await self._do("exec", url)
+        return status, response
+
+    async def ws_lock(self, adom):
+        return await self._workspace(adom, "lock")
+
+    async def ws_commit(self, adom):
+        return await self._workspace(adom, "commit")
+
+    async def ws_unlock(self, adom):
+        return await self._workspace(adom, "unlock")
+
+    async def pkg_lock(self, adom, pkgpath):
+        return await self._workspace(adom, "lock", pkgpath)
+
+    async def pkg_commit(self, adom, pkgpath):
+        return await self._workspace(adom, "commit", pkgpath)
+
+    async def pkg_unlock(self, adom, pkgpath):
+        return await self._workspace(adom, "unlock", pkgpath)
@@ -0,0 +1,116 @@
+# coding: utf-8
+
+"""
+fmg_mirror.py
+
+Keep a local copy of ADOM object tables up to date without downloading
+them entirely on each refresh.
+"""
+
+
+class AdomMirror(object):
+    """
+    Incremental mirror of FortiManager ADOM tables.
+
+    fmg: a logged-in FortiManagerJSON
+    adom: ADOM name
+    tables: {table: (key, fields)} where table is relative to
+            pm/config/adom/<adom>/ (e.g. "obj/firewall/address" or
+            "pkg/default/firewall/policy"), key is the attribute identifying
+            an entry (e.g. "name" or "policyid") and fields are the
+            attributes whose change marks an entry as modified. With no
+            fields, only added and deleted entries are detected.
+
+    The first refresh() downloads the tables. The next ones only get the
+    key and fields of each entry, compare them with the stored ones and
+    download the full body of the new or modified entries:
+
+        mirror = AdomMirror(fmg, "root", {
+            "obj/firewall/address": ("name", ["subnet", "type", "comment"]),
+        })
+        mirror.refresh()
+        changes = mirror.refresh()
+        addresses = mirror.tables["obj/firewall/address"]  # {name: entry}
+    """
+
+    def __init__(self, fmg, adom, tables, page_size=1000, chunk_size=100):
+        self._fmg = fmg
+        self._adom = adom
+        self._specs = dict(tables)
+        self._page_size = page_size
+        self._chunk_size = chunk_size
+        self.tables = {}
+        self._fingerprints = {}
+
+    def _url(self, table):
+        return "pm/config/adom/" + str(self._adom) + "/" + table.strip("/")
+
+    def _fingerprint(self, fields, entry):
+        return [entry.get(field) for field in fields]
+
+    def refresh(self, tables=None):
+        """
+        Update the mirror, all tables or only the given ones.
+
+        Return {table: {"added": [keys], "changed": [keys], "deleted": [keys]}}.
+        Raise FortiManagerJSONError on error, the mirror is left unchanged
+        for the table being refreshed.
+        """
+        changes = {}
+        for table in tables or self._specs:
+            if table in self.tables:
+                changes[table] = self._update(table)
+            else:
+                changes[table] = self._load(table)
+        return changes
+
+    def _load(self, table):
+        key, fields = self._specs[table]
+        entries = {}
+        fingerprints = {}
+        for entry in self._fmg.iter_get(self._url(table), self._page_size):
+            entries[entry[key]] = entry
+            fingerprints[entry[key]] = self._fingerprint(fields, entry)
+        self.tables[table] = entries
+        self._fingerprints[table] = fingerprints
+        return {"added": list(entries), "changed": [], "deleted": []}
+
+    def _update(self, table):
+        key, fields = self._specs[table]
+        url = self._url(table)
+        stored = self._fingerprints[table]
+
+        fingerprints = {}
+        added = []
+        changed = []
+        projection = [key] + [field for field in fields if field != key]
+        for entry in self._fmg.iter_get(url, self._page_size, fields=projection):
+            fingerprint = self._fingerprint(fields, entry)
+            fingerprints[entry[key]] = fingerprint
+            if entry[key] not in stored:
+                added.append(entry[key])
+            elif stored[entry[key]] != fingerprint:
+                changed.append(entry[key])
+        deleted = [name for name in stored if name not in fingerprints]
+
+        bodies = {}
+        fetch = added + changed
+        for start in range(0, len(fetch), self._chunk_size):
+            keys = fetch[start : start + self._chunk_size]
+            data = {"filter": [key, "in"] + keys}
+            for entry in self._fmg.iter_get(url, self._page_size, data):
+                bodies[entry[key]] = entry
+
+        entries = self.tables[table]
+        for name in deleted:
+            entries.pop(name, None)
+        for name in fetch:
+            if name in bodies:
+                entries[name] = bodies[name]
+                fingerprints[name] = self._fingerprint(fields, bodies[name])
+            else:
+                # Deleted between the two requests
+                fingerprints.pop(name, None)
+                entries.pop(name, None)
+        self._fingerprints[table] = fingerprints
+        return {"added": added, "changed": changed, "deleted": deleted}
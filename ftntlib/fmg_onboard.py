@@ -0,0 +1,278 @@
+# coding: utf-8
+
+"""
+fmg_onboard.py
+
+Onboard many devices on a FortiManager: concurrent discovery, chunked
+dev-list commands and overlapping task waits.
+"""
+
+import collections
+import concurrent.futures
+import time
+
+from .fmg_jsonapi import TASK_TIMEOUT
+from .fmg_tasks import TaskPool
+
+# (stage of the devices, dev-list command moving them on, stage reached)
+_STAGES = (
+    ("discovered", "add", "added"),
+    ("added", "update", "updated"),
+    ("updated", "reload", "done"),
+)
+_NEXT = dict((command, reached) for _, command, reached in _STAGES)
+
+
+def _payload(data):
+    # dvm commands answer either {...} or {"data": {...}}
+    if isinstance(data, dict) and "data" in data:
+        return data["data"]
+    return data
+
+
+class DeviceOnboarder(object):
+    """
+    Bulk device onboarding pipeline.
+
+    fmg: a logged-in FortiManagerJSON
+    adom: ADOM to add the devices to
+    workers: concurrent discovery requests
+    chunk_size: devices per dvm/cmd/.../dev-list request
+    max_tasks: FortiManager tasks running at the same time
+    timeout: seconds given to the tasks of a run, the jobs not started by
+             then fail (None: no limit)
+    progress: optional callable(ip, result) called on each device change
+
+    Each device goes through discovery, add (dvm/cmd/add/dev-list), update
+    (dvm/cmd/update/dev-list) and reload (dvm/cmd/reload/dev-list), joining
+    the next stage as soon as its own is done. A device failing at a stage
+    keeps the stages already done, retry() resumes the failed devices where
+    they stopped:
+
+        onboarder = DeviceOnboarder(fmg, "root", workers=16, chunk_size=50)
+        results = onboarder.run([
+            {"ip": "10.0.0.1", "username": "admin", "password": "..."},
+            ...
+        ])
+        results = onboarder.retry()
+
+    results is {ip: {"stage", "name", "error", "elapsed"}}, stage "done"
+    means the device is onboarded.
+    """
+
+    def __init__(
+        self,
+        fmg,
+        adom,
+        workers=8,
+        chunk_size=50,
+        max_tasks=4,
+        timeout=None,
+        mgmt_mode=3,
+        progress=None,
+    ):
+        self._fmg = fmg
+        self._adom = adom
+        self._workers = workers
+        self._chunk_size = chunk_size
+        self._max_tasks = max_tasks
+        self._timeout = timeout
+        self._mgmt_mode = mgmt_mode
+        self._progress = progress
+        self._devices = collections.OrderedDict()
+        self.results = collections.OrderedDict()
+
+    def run(self, devices):
+        """
+        Onboard devices, a list of dicts with ip, username, password and
+        optionally name and mgmt_mode.
+        """
+        for device in devices:
+            ip = device["ip"]
+            self._devices[ip] = dict(device)
+            if ip not in self.results:
+                self.results[ip] = {
+                    "stage": "pending",
+                    "name": device.get("name"),
+                    "error": None,
+                    "elapsed": 0.0,
+                    "_start": None,
+                }
+        return self._process([device["ip"] for device in devices])
+
+    def retry(self):
+        """
+        Run the failed devices again, from the stage they failed at.
+        """
+        return self._process(
+            [ip for ip, result in self.results.items() if result["error"]]
+        )
+
+    def failed(self):
+        return [ip for ip, result in self.results.items() if result["error"]]
+
+    def _process(self, ips):
+        start = time.time()
+        for ip in ips:
+            self.results[ip]["error"] = None
+            self.results[ip]["_start"] = start
+        queues = dict((stage, collections.deque()) for stage, _, _ in _STAGES)
+        discover = []
+        for ip in ips:
+            stage = self.results[ip]["stage"]
+            if stage == "pending":
+                discover.append(ip)
+            elif stage in queues:
+                queues[stage].append(ip)
+        tasks = TaskPool(self._fmg, self._max_tasks, self._timeout)
+        with concurrent.futures.ThreadPoolExecutor(self._workers) as executor:
+            discovering = dict(
+                (executor.submit(self._discover_one, ip), ip) for ip in discover
+            )
+            while discovering or tasks or any(queues.values()):
+                for future in [future for future in discovering if future.done()]:
+                    ip = discovering.pop(future)
+                    if self._discovered(ip, future):
+                        queues["discovered"].append(ip)
+                self._launch(queues, discovering, tasks)
+                if not discovering and not tasks:
+                    # Out of time before launching the remaining jobs
+                    for queue in queues.values():
+                        for ip in queue:
+                            self._set(ip, error="Not started before the timeout")
+                        queue.clear()
+                    break
+                finished = tasks.poll()
+                for (command, chunk), taskid, status, task in finished:
+                    stage = _NEXT[command]
+                    self._task_done(taskid, chunk, status, task, stage)
+                    if stage in queues:
+                        queues[stage].extend(ip for ip in chunk if self._stage(ip))
+                if finished:
+                    continue
+                if discovering:
+                    concurrent.futures.wait(
+                        discovering,
+                        tasks.delay() if tasks else None,
+                        concurrent.futures.FIRST_COMPLETED,
+                    )
+                elif tasks:
+                    time.sleep(tasks.delay())
+        return dict(
+            (ip, dict((k, v) for k, v in result.items() if not k.startswith("_")))
+            for ip, result in self.results.items()
+        )
+
+    def _stage(self, ip):
+        result = self.results[ip]
+        return None if result["error"] else result["stage"]
+
+    def _set(self, ip, stage=None, error=None):
+        result = self.results[ip]
+        if stage is not None:
+            result["stage"] = stage
+        result["error"] = error
+        result["elapsed"] = time.time() - result["_start"]
+        if self._progress:
+            self._progress(ip, dict(result))
+
+    # Discovery
+
+    def _discover_one(self, ip):
+        device = self._devices[ip]
+        return self._fmg.discover_device(ip, device["username"], device["password"])
+
+    def _discovered(self, ip, future):
+        try:
+            status, response = future.result()
+        except Exception as err:
+            self._set(ip, error=str(err))
+            return False
+        discovered = _payload(response)
+        if status.get("code") != 0 or "device" not in discovered:
+            self._set(ip, error=status)
+            return False
+        device = self._devices[ip]
+        found = dict(discovered["device"])
+        found["adm_usr"] = device["username"]
+        found["adm_pass"] = device["password"]
+        found["mgmt_mode"] = device.get("mgmt_mode", self._mgmt_mode)
+        if device.get("name"):
+            found["name"] = device["name"]
+        device["found"] = found
+        self.results[ip]["name"] = found.get("name")
+        self._set(ip, "discovered")
+        return True
+
+    # Tasks
+
+    def _launch(self, queues, discovering, tasks):
+        """
+        Launch the dev-list commands of the queued devices, the later
+        stages first. A partial chunk is only sent once no device can join
+        it, i.e. when the previous stages are done.
+        """
+        running = collections.Counter(command for command, _ in tasks.jobs())
+        upstream = [bool(discovering)]
+        for stage, command, _ in _STAGES:
+            upstream.append(upstream[-1] or bool(queues[stage]) or running[command])
+        for index in reversed(range(len(_STAGES))):
+            stage, command, _ = _STAGES[index]
+            queue = queues[stage]
+            while queue and tasks.available():
+                if len(queue) < self._chunk_size and upstream[index]:
+                    break
+                chunk = [
+                    queue.popleft() for _ in range(min(self._chunk_size, len(queue)))
+                ]
+                url, data = self._command(command, chunk)
+                taskid, status = tasks.launch(url, data, (command, chunk))
+                if not taskid:
+                    for ip in chunk:
+                        self._set(ip, error=status)
+
+    def _command(self, command, ips):
+        if command == "add":
+            data = {
+                "adom": self._adom,
+                "add-dev-list": [self._devices[ip]["found"] for ip in ips],
+                "flags": ["create_task", "nonblocking"],
+            }
+            return "dvm/cmd/add/dev-list", data
+        members = [{"name": self.results[ip]["name"]} for ip in ips]
+        data = {
+            "adom": self._adom,
+            "reload-dev-member-list": members,
+            "flags": ["create_task", "nonblocking"],
+        }
+        if command == "reload":
+            data["tag"] = "Retrieved from JSON API"
+            data["from"] = "dvm"
+        return "dvm/cmd/" + command + "/dev-list", data
+
+    def _task_done(self, taskid, ips, status, task, stage):
+        if status == TASK_TIMEOUT:
+            for ip in ips:
+                self._set(ip, error="Task {} timed out".format(taskid))
+            return
+        if status.get("code") != 0:
+            for ip in ips:
+                self._set(ip, error=status)
+            return
+        lines = dict((line.get("name"), line) for line in task.get("line") or [])
+        for ip in ips:
+            line = lines.get(self.results[ip]["name"])
+            if line is None and lines:
+                line = lines.get(ip)
+            if line is not None and line.get("err"):
+                self._set(ip, error=line.get("detail") or line)
+            elif line is None and task.get("num_err"):
+                # Can't tell whether this device is one of the errors
+                self._set(
+                    ip,
+                    error="Task {} has {} error(s) and no line for {}".format(
+                        task.get("id"), task.get("num_err"), ip
+                    ),
+                )
+            else:
+                self._set(ip, stage)
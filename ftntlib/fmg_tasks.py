@@ -0,0 +1,162 @@
+# coding: utf-8
+
+"""
+fmg_tasks.py
+
+Run many FortiManager tasks at once: a bounded number of exec commands
+creating tasks, polled together until a single deadline.
+"""
+
+import collections
+import time
+
+from .fmg_jsonapi import TASK_TIMEOUT
+
+
+def _taskid(response):
+    # Commands answer {"task": id}, {"taskid": id} or {"data": {...}}
+    if isinstance(response, dict) and "data" in response:
+        response = response["data"]
+    if isinstance(response, dict):
+        return response.get("task") or response.get("taskid")
+    return None
+
+
+class TaskPool(object):
+    """
+    FortiManager tasks launched by exec commands and polled together.
+
+    fmg: a logged-in FortiManagerJSON
+    max_tasks: tasks running at the same time
+    timeout: seconds from the creation of the pool after which no task is
+             launched and the running ones are given up (None: no limit)
+    interval, max_interval, backoff: poll interval, see taskwait_many()
+
+    Each task carries a job, any object given to launch() and returned
+    with the task result:
+
+        tasks = TaskPool(fmg, max_tasks=4, timeout=600)
+        while pending or tasks:
+            while pending and tasks.available():
+                job = pending.popleft()
+                taskid, status = tasks.launch(url, data, job)
+            for job, taskid, status, task in tasks.wait():
+                ...
+
+    A task still running at the deadline is returned with the status
+    TASK_TIMEOUT.
+    """
+
+    def __init__(
+        self,
+        fmg,
+        max_tasks=4,
+        timeout=None,
+        interval=0.5,
+        max_interval=5,
+        backoff=1.5,
+        chunk_size=100,
+    ):
+        self._fmg = fmg
+        self._max_tasks = max_tasks
+        self._base_interval = interval
+        self._interval = interval
+        self._next_poll = 0
+        self._max_interval = max_interval
+        self._backoff = backoff
+        self._chunk_size = chunk_size
+        self._active = collections.OrderedDict()
+        self.deadline = None if timeout is None else time.time() + timeout
+
+    def __len__(self):
+        return len(self._active)
+
+    def jobs(self):
+        """
+        Return the jobs of the running tasks.
+        """
+        return list(self._active.values())
+
+    def expired(self):
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def available(self):
+        """
+        Return True when a task can be launched now.
+        """
+        return len(self._active) < self._max_tasks and not self.expired()
+
+    def launch(self, url, data, job):
+        """
+        exec url with data and track the task it creates.
+
+        Return (taskid, status), taskid is None when no task was created
+        (status is then the error status or the transport error message).
+        """
+        # Never affected by the chroot/skip/verbose/params settings
+        options = {"root": False, "skip": False, "verbose": False, "params": False}
+        params = [{"url": url, "data": data}]
+        response = self._fmg.http_request("exec", params, options)
+        if isinstance(response, Exception):
+            return None, str(response)
+        status, response = response
+        if status.get("code") != 0:
+            return None, status
+        taskid = _taskid(response)
+        if taskid:
+            self._active[taskid] = job
+            # A new task is polled at the initial interval
+            self._interval = self._base_interval
+            self._next_poll = min(self._next_poll, time.time() + self._interval)
+        return taskid, status
+
+    def poll(self):
+        """
+        Poll the running tasks when a poll is due (see delay()) and return
+        the (job, taskid, status, task) of those finished or failed. Past
+        the deadline, the tasks still running are returned too, with the
+        status TASK_TIMEOUT.
+        """
+        if not self._active:
+            return []
+        expired = self.expired()
+        if not expired and time.time() < self._next_poll:
+            return []
+        self._next_poll = time.time() + self._interval
+        self._interval = min(self._interval * self._backoff, self._max_interval)
+        finished = []
+        polled = self._fmg._task_status(list(self._active), self._chunk_size)
+        for taskid, (status, task) in polled:
+            if status.get("code") != 0 or task.get("percent") == 100:
+                finished.append((self._active.pop(taskid), taskid, status, task))
+            elif expired:
+                job = self._active.pop(taskid)
+                finished.append((job, taskid, dict(TASK_TIMEOUT), task))
+        if expired:
+            # Not polled because of a transport error
+            for taskid, job in list(self._active.items()):
+                del self._active[taskid]
+                finished.append((job, taskid, dict(TASK_TIMEOUT), {}))
+        return finished
+
+    def delay(self):
+        """
+        Return the seconds left before the next poll is due, the interval
+        growing by backoff up to max_interval, and never past the deadline.
+        """
+        due = self._next_poll
+        if self.deadline is not None:
+            due = min(due, self.deadline)
+        return max(0, due - time.time())
+
+    def wait(self):
+        """
+        Poll until at least one task is finished (or the deadline is
+        reached) and return them, see poll().
+        """
+        while self._active:
+            finished = self.poll()
+            if finished:
+                return finished
+            time.sleep(self.delay())
+        return []
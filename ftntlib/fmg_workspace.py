@@ -0,0 +1,117 @@
+# coding: utf-8
+
+"""
+fmg_workspace.py
+
+Workspace transactions: writes are collected and checked locally, the ADOM
+(or package) is only locked while they are sent in batched requests.
+"""
+
+import time
+
+from .fmg_batch import FortiManagerJSONBatch
+from .fmg_cache import WRITE_METHODS
+from .fmg_jsonapi import FortiManagerJSONError
+
+
+class WorkspaceTransaction(FortiManagerJSONBatch):
+    """
+    Batch of writes sent inside a workspace lock/commit/unlock.
+
+    fmg: a logged-in FortiManagerJSON
+    adom: ADOM to lock
+    pkgpath: lock only this policy package (pkg_lock) instead of the ADOM
+    chunk_size: maximum number of params entries sent per datagram
+
+    The write verbs (add, set, update, ...) only queue the calls, after
+    checking that they are writes with a URL inside the ADOM. commit()
+    locks, sends the writes in multi-entry requests, commits and unlocks.
+    The workspace is always unlocked, without commit if a write fails:
+
+        with WorkspaceTransaction(fmg, "root") as tx:
+            for address in addresses:
+                tx.add("pm/config/adom/root/obj/firewall/address", address)
+        print(tx.lock_time)
+
+    commit() raises FortiManagerJSONError on the first failing lock, write
+    or commit request.
+    """
+
+    def __init__(self, fmg, adom, pkgpath=None, chunk_size=100):
+        super(WorkspaceTransaction, self).__init__(fmg, chunk_size)
+        self._adom = adom
+        self._pkgpath = pkgpath
+        self._prefix = "pm/config/adom/" + str(adom) + "/"
+        self.lock_time = None
+
+    def _queue(self, method, params):
+        if method not in WRITE_METHODS:
+            raise ValueError("{} is not a write method".format(method))
+        url = str(params["url"]).strip("/") + "/"
+        if not url.startswith(self._prefix):
+            raise ValueError("{} is not in ADOM {}".format(params["url"], self._adom))
+        if method in ("add", "set", "update", "replace") and not isinstance(
+            params.get("data"), (dict, list)
+        ):
+            raise ValueError("{} {} has no data".format(method, params["url"]))
+        return super(WorkspaceTransaction, self)._queue(method, params)
+
+    def get(self, url, data={}):
+        raise ValueError("get is not a write method")
+
+    def execute(self, url, data={}):
+        raise ValueError("exec is not a write method")
+
+    def _url(self, action):
+        url = "pm/config/adom/" + str(self._adom) + "/_workspace/" + action
+        if self._pkgpath:
+            url += "/" + str(self._pkgpath)
+        return url
+
+    def _request(self, action):
+        # Return the status, a transport error being turned into a status
+        options = {"root": False, "skip": False, "verbose": False}
+        response = self._fmg.http_request("exec", [{"url": self._url(action)}], options)
+        if isinstance(response, Exception):
+            return {"code": 1, "message": str(response)}
+        return response[0]
+
+    def _workspace(self, action):
+        status = self._request(action)
+        if status.get("code") != 0:
+            raise FortiManagerJSONError(self._url(action), status)
+
+    def commit(self):
+        """
+        Lock, send the pending writes, commit and unlock.
+
+        Return the (status, data) tuples of the writes sent.
+        """
+        if not self._entries:
+            return []
+        start = time.time()
+        self._workspace("lock")
+        results = []
+        committed = False
+        try:
+            for method, chunk in self._chunks():
+                response = self._fmg.http_request_list(method, chunk)
+                results.extend(self._chunk_results(chunk, response))
+                for params, (status, data) in zip(chunk, results[-len(chunk) :]):
+                    if status.get("code") != 0:
+                        raise FortiManagerJSONError(params["url"], status)
+            self._workspace("commit")
+            committed = True
+        finally:
+            # Also reached on KeyboardInterrupt/SystemExit: never leave the
+            # workspace locked
+            self.results.extend(results)
+            try:
+                if committed:
+                    self._workspace("unlock")
+                else:
+                    # Unlocking without commit discards the writes already sent
+                    self._request("unlock")
+            finally:
+                self.lock_time = time.time() - start
+        return results
@@ -13,6 +13,9 @@ import requests
 import json
 import urllib.parse
 
+from .codec import get_codec
+from .compression import get_compression
+
 
 class FortiOSREST(object):
     def __init__(self):
@@ -22,6 +25,8 @@ class FortiOSREST(object):
         self._session = requests.session()  # use single session for all requests
         self._auth_token = None
         self.log_session_id = None
+        self._codec = get_codec()
+        self._compression = None
 
     def jprint(self, json_obj):
         return json.dumps(json_obj, indent=2, sort_keys=True)
@@ -46,7 +51,7 @@ class FortiOSREST(object):
                     try:
                         j = json.loads(body)
                     except (ValueError, TypeError):
-                        print("\n" + body)
+                        print("\n" + str(body))
                     else:
                         print("\n" + json.dumps(j, indent=2, sort_keys=True))
 
@@ -84,6 +89,20 @@ class FortiOSREST(object):
         if status == "off":
             self._http_debug = False
 
+    def codec(self, codec):
+        # "auto", "json", "orjson" or a codec object, see ftntlib.codec
+        self._codec = get_codec(codec)
+
+    def compression(self, status, **settings):
+        # "on" (settings: encoding, threshold, level, accept, see
+        # ftntlib.compression), "off" or a Compression instance
+        self._compression = get_compression(self._compression, status, **settings)
+
+    def compression_stats(self):
+        if self._compression is None:
+            return None
+        return self._compression.stats()
+
     def https(self, status):
         if status == "on":
             self._https = True
@@ -162,7 +181,7 @@ class FortiOSREST(object):
 
         url = self._url_prefix + url_postfix
         data = {"path": path, "name": name, "action": action}
-        payload = payload_prefix + json.dumps(data)
+        payload = payload_prefix + self._codec.dumps(data).decode("utf-8")
 
         res = self._session.get(url, params=payload)
         self.dprint(res)
@@ -178,7 +197,7 @@ class FortiOSREST(object):
         if not self.log_session_id:
             content = self.get("log", path, name, action=action, mkey=mkey)
             try:
-                data = json.loads(content)
+                data = self._codec.loads(content)
             except Exception as err:
                 print("Can not get session_id (%s): %s" % (err, content))
                 return content
@@ -189,31 +208,36 @@ class FortiOSREST(object):
             "log", path, name, action=action, mkey=mkey, parameters=parameters
         )
 
-    def get(self, api, path, name, action=None, mkey=None, parameters=None, data=None):
-        url = self.get_url(api, path, name, action, mkey)
-        res = self._session.get(url, params=parameters, data=json.dumps(data))
+    def _send(self, method, url, parameters, data):
+        body = self._codec.dumps(data)
+        headers = {}
+        if self._compression is not None:
+            body = self._compression.encode(body, headers)
+        res = self._session.request(
+            method, url, params=parameters, data=body, headers=headers
+        )
+        if self._compression is not None:
+            self._compression.received(res)
         self.dprint(res)
         return res.content
 
+    def get(self, api, path, name, action=None, mkey=None, parameters=None, data=None):
+        url = self.get_url(api, path, name, action, mkey)
+        return self._send("GET", url, parameters, data)
+
     def post(self, api, path, name, action=None, mkey=None, parameters=None, data=None):
         url = self.get_url(api, path, name, action, mkey)
-        res = self._session.post(url, params=parameters, data=json.dumps(data))
-        self.dprint(res)
-        return res.content
+        return self._send("POST", url, parameters, data)
 
     def put(self, api, path, name, action=None, mkey=None, parameters=None, data=None):
         url = self.get_url(api, path, name, action, mkey)
-        res = self._session.put(url, params=parameters, data=json.dumps(data))
-        self.dprint(res)
-        return res.content
+        return self._send("PUT", url, parameters, data)
 
     def delete(
         self, api, path, name, action=None, mkey=None, parameters=None, data=None
     ):
         url = self.get_url(api, path, name, action, mkey)
-        res = self._session.delete(url, params=parameters, data=json.dumps(data))
-        self.dprint(res)
-        return res.content
+        return self._send("DELETE", url, parameters, data)
 
 
 if __name__ == "__main__":
@@ -6,6 +6,8 @@ import json
 import logging
 logging.captureWarnings(True)
 
+from .codec import get_codec
+
 class fpcapi:
     def __init__(self):
         self._debug = False
@@ -15,6 +17,7 @@ class fpcapi:
         }
         self.s.headers.update(self.s.headers)
         self.base_url = "https://{}/fpc/api"
+        self._codec = get_codec()
 
     def login(self, ip, login, password):
         self.base_url = self.base_url.format(ip)
@@ -23,11 +26,12 @@ class fpcapi:
             "user": login,
             "password": password,
         }
-        r = self.s.post(url, json=data, verify=False)
+        r = self.s.post(url, data=self._codec.dumps(data),
+                        headers=self.headers, verify=False)
 
         self.debug_print(r)
         
-        response = r.json()
+        response = self._codec.loads(r.content)
 
         self.sid = response["fpc-sid"]
         self.headers["fpc-sid"] = self.sid
@@ -45,6 +49,10 @@ class fpcapi:
         else:
             self._debug = False
 
+    def codec(self, value):
+        # 'auto', 'json', 'orjson' or a codec object, see ftntlib.codec
+        self._codec = get_codec(value)
+
     def get(self, endpoint):
         endpoint = endpoint.strip('/')
         url = "{}/{}".format(self.base_url, endpoint)
@@ -58,7 +66,8 @@ class fpcapi:
         endpoint = endpoint.strip('/')        
         url = "{}/{}".format(self.base_url, endpoint)        
 
-        r = self.s.post(url, json=data)
+        r = self.s.post(url, data=self._codec.dumps(data),
+                        headers=self.headers)
 
         self.debug_print(r)
 
@@ -0,0 +1,59 @@
+# coding: utf-8
+
+"""
+hooks.py
+
+Request/response hooks for the JSON API clients.
+
+A hook is a callable registered with client.hook(event, callback):
+
+- "request" hooks are called before a datagram is sent with a dict holding:
+  id, method, url (first params url), datagram, bytes (request body size)
+- "response" hooks are called once the answer is decoded (or the request
+  failed) with a dict holding: id, method, url, datagram, bytes (response
+  body size), elapsed (seconds), status_code and either response (decoded
+  JSON) or error (exception). For streamed responses (get_stream), bytes
+  and status_code are replaced by entries (number of entries decoded) and
+  response holds the response without its data
+
+Nothing is computed when no hook is registered.
+"""
+
+import json
+
+
+class JSONPrinter(object):
+    """
+    Hook printing the JSON-RPC datagrams and responses, used by debug("on").
+
+    With bbcode enabled, the output is wrapped in BBCode tags.
+    """
+
+    def __init__(self, bbcode=False):
+        self.bbcode = bbcode
+
+    def jprint(self, json_obj):
+        return json.dumps(json_obj, indent=2, sort_keys=True)
+
+    def dprint(self, msg, json_obj):
+        if self.bbcode:
+            msg = "[color=#008080][b]" + msg + "[/b][/color]"
+            text = "[code]" + self.jprint(json_obj) + "[/code]"
+        else:
+            text = self.jprint(json_obj)
+        print(msg)
+        print(text)
+
+    def request(self, info):
+        self.dprint("REQUEST:", info["datagram"])
+
+    def response(self, info):
+        if "response" in info:
+            self.dprint("RESPONSE:", info["response"])
+
+
+def first_url(datagram):
+    params = datagram.get("params")
+    if params and isinstance(params, list) and isinstance(params[0], dict):
+        return params[0].get("url")
+    return None
@@ -0,0 +1,236 @@
+# coding: utf-8
+
+"""
+jsonstream.py
+
+Incremental decoding of JSON-RPC responses.
+
+The response body is read chunk by chunk and the elements of the
+result[*].data lists are yielded as soon as they are complete, so a huge
+response is never held entirely in memory, neither as text nor as objects.
+The other members (id, status, url...) are kept in the envelope.
+"""
+
+import codecs
+import json
+
+_WHITESPACE = " \t\n\r"
+# Characters continuing a number, "1." or "1e" may be cut from "1.5" or "1e5"
+_NUMBER = "0123456789+-.eE"
+
+# Yielded by JSONStreamParser.parse() when it needs the next chunk
+NEED_DATA = object()
+
+
+class JSONStreamError(ValueError):
+    pass
+
+
+class JSONStreamParser(object):
+    """
+    Pull parser over an iterable of bytes (or str) chunks.
+
+    items() yields (index, element) for each element of result[index].data,
+    or (index, data) once when data is not a list. When items() is
+    exhausted, envelope holds the response without the data members:
+
+        parser = JSONStreamParser(response.iter_content(65536))
+        for index, entry in parser.items():
+            ...
+        status = parser.envelope["result"][0]["status"]
+
+    Without chunks, the parser is fed by the caller instead: parse() yields
+    the same items, and NEED_DATA when the next chunk must be given with
+    feed() (or close() at the end of the response):
+
+        parser = JSONStreamParser()
+        for item in parser.parse():
+            if item is NEED_DATA:
+                chunk = await response.content.read(65536)
+                parser.feed(chunk) if chunk else parser.close()
+            else:
+                index, entry = item
+    """
+
+    def __init__(self, chunks=None):
+        self._chunks = iter(chunks) if chunks is not None else None
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._pending = []
+        self._pending_size = 0
+        self._pos = 0
+        self._eof = False
+        self._need = 0
+        self.envelope = {}
+
+    # Buffer
+
+    def feed(self, chunk):
+        """
+        Add the next chunk of the response to the pending list. Chunks are
+        only joined to the buffer by _join(), appending each one to the
+        buffer would copy it every time.
+        """
+        if isinstance(chunk, bytes):
+            chunk = self._decoder.decode(chunk)
+        if chunk:
+            self._pending.append(chunk)
+            self._pending_size += len(chunk)
+
+    def close(self):
+        """
+        Mark the end of the response.
+        """
+        if not self._eof:
+            self.feed(self._decoder.decode(b"", True))
+            self._eof = True
+
+    def _fill(self):
+        # Feed the next non-empty chunk, or close at the end of the chunks
+        for chunk in self._chunks:
+            self.feed(chunk)
+            if self._pending:
+                return
+        self.close()
+
+    def _join(self):
+        # Drop what was consumed and append the pending chunks, in one copy
+        if self._pending:
+            self._pending.insert(0, self._buffer[self._pos :])
+            self._buffer = "".join(self._pending)
+            self._pos = 0
+            self._pending = []
+            self._pending_size = 0
+
+    # The following generators yield NEED_DATA when the buffer runs out
+
+    def _peek(self):
+        while True:
+            while self._pos < len(self._buffer):
+                char = self._buffer[self._pos]
+                if char not in _WHITESPACE:
+                    return char
+                self._pos += 1
+            if not self._pending:
+                if self._eof:
+                    raise JSONStreamError("Unexpected end of response")
+                yield NEED_DATA
+            self._join()
+
+    def _expect(self, chars):
+        char = yield from self._peek()
+        if char not in chars:
+            raise JSONStreamError(
+                "Expected {!r} at {!r}".format(
+                    chars, self._buffer[self._pos : self._pos + 32]
+                )
+            )
+        self._pos += 1
+        return char
+
+    def _value(self):
+        """
+        Decode the next complete value. A number is only complete when
+        followed by a character that can't be part of it.
+        """
+        yield from self._peek()
+        while True:
+            # Retrying after each chunk would be quadratic on big values
+            available = len(self._buffer) - self._pos + self._pending_size
+            if available >= self._need or self._eof:
+                self._join()
+                try:
+                    value, end = self._json.raw_decode(self._buffer, self._pos)
+                except ValueError:
+                    if self._eof:
+                        raise
+                else:
+                    if self._eof or (
+                        end < len(self._buffer) and self._buffer[end] not in _NUMBER
+                    ):
+                        self._pos = end
+                        self._need = 0
+                        return value
+                self._need = 2 * (len(self._buffer) - self._pos)
+            yield NEED_DATA
+
+    # Structure
+
+    def _members(self):
+        """
+        Yield the keys of the object starting at the current position, the
+        caller consumes the value of each key.
+        """
+        yield from self._expect("{")
+        if (yield from self._peek()) == "}":
+            self._pos += 1
+            return
+        while True:
+            key = yield from self._value()
+            yield from self._expect(":")
+            yield key
+            if (yield from self._expect(",}")) == "}":
+                return
+
+    def items(self):
+        if self._chunks is None:
+            raise TypeError("items() needs chunks, use parse() and feed()")
+        for item in self.parse():
+            if item is NEED_DATA:
+                self._fill()
+            else:
+                yield item
+
+    def parse(self):
+        for key in self._members():
+            if key is NEED_DATA:
+                yield key
+            elif key == "result" and (yield from self._peek()) == "[":
+                self.envelope["result"] = []
+                yield from self._results()
+            else:
+                self.envelope[key] = yield from self._value()
+
+    def _results(self):
+        yield from self._expect("[")
+        if (yield from self._peek()) == "]":
+            self._pos += 1
+            return
+        index = 0
+        while True:
+            if (yield from self._peek()) != "{":
+                self.envelope["result"].append((yield from self._value()))
+            else:
+                result = {}
+                self.envelope["result"].append(result)
+                for key in self._members():
+                    if key is NEED_DATA:
+                        yield key
+                    elif key == "data":
+                        for data in self._data():
+                            yield data if data is NEED_DATA else (index, data)
+                    else:
+                        result[key] = yield from self._value()
+            index += 1
+            if (yield from self._expect(",]")) == "]":
+                return
+
+    def _data(self):
+        if (yield from self._peek()) != "[":
+            yield (yield from self._value())
+            return
+        self._pos += 1
+        if (yield from self._peek()) == "]":
+            self._pos += 1
+            return
+        while True:
+            yield (yield from self._value())
+            # The separator is usually right after the element
+            char = self._buffer[self._pos : self._pos + 1]
+            if char and char in ",]":
+                self._pos += 1
+            else:
+                char = yield from self._expect(",]")
+            if char == "]":
+                return
@@ -0,0 +1,223 @@
+# coding: utf-8
+
+"""
+session_pool.py
+
+Keep several logged-in FortiManagerJSON/FortiAnalyzerJSON sessions warm and
+hand them out to worker threads.
+"""
+
+import contextlib
+import queue
+import threading
+
+# FortiManager/FortiAnalyzer status code returned when the session is no
+# longer valid (expired or killed by an administrator).
+INVALID_SESSION_CODES = (-11,)
+
+
+class SessionPoolError(Exception):
+    """Session pool error."""
+
+
+def status_code(response):
+    """
+    Return the status code of a FortiManagerJSON or FortiAnalyzerJSON answer.
+
+    FortiManagerJSON returns a (status, data) tuple, FortiAnalyzerJSON returns
+    the JSON-RPC result (a list of dicts or a dict). None is returned when
+    there is no status (e.g. connection error).
+    """
+    if isinstance(response, tuple):
+        response = response[0]
+        return response.get("code") if isinstance(response, dict) else None
+    if isinstance(response, list):
+        response = response[0] if response else {}
+    if isinstance(response, dict):
+        return response.get("status", {}).get("code")
+    return None
+
+
+class JSONSessionPool(object):
+    """
+    Pool of authenticated JSON API sessions.
+
+    cls: FortiManagerJSON or FortiAnalyzerJSON (or any class with the same
+         login/logout/get methods)
+    ip, user, passwd, ssl: login() parameters
+    size: number of sessions kept logged in
+    keepalive: seconds between two checks of the idle sessions, an idle
+               session which does not answer is logged in again
+    setup: optional callable(client) run on each new client before login
+    relogin_codes: status codes meaning the session must be renewed
+
+    Usage:
+
+        with JSONSessionPool(FortiManagerJSON, ip, user, passwd, size=8) as pool:
+            with pool.checkout() as fmg:
+                fmg.get("dvmdb/adom")
+            pool.call("get", "dvmdb/device")
+    """
+
+    def __init__(
+        self,
+        cls,
+        ip,
+        user,
+        passwd,
+        size=4,
+        ssl=True,
+        keepalive=300,
+        setup=None,
+        relogin_codes=INVALID_SESSION_CODES,
+    ):
+        self._cls = cls
+        self._ip = ip
+        self._user = user
+        self._passwd = passwd
+        self._ssl = ssl
+        self._size = size
+        self._keepalive = keepalive
+        self._setup = setup
+        self._relogin_codes = relogin_codes
+        self._idle = queue.Queue()
+        self._clients = []
+        self._closed = threading.Event()
+        self._thread = None
+        self.relogins = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _login(self, client):
+        client._sid = None
+        response = client.login(self._ip, self._user, self._passwd, ssl=self._ssl)
+        if status_code(response) != 0:
+            raise SessionPoolError("Login to {} failed: {}".format(self._ip, response))
+
+    def _new_client(self):
+        client = self._cls()
+        if self._setup:
+            self._setup(client)
+        self._login(client)
+        return client
+
+    def _relogin(self, client):
+        try:
+            client.logout()
+        except Exception:
+            pass
+        self._login(client)
+        self.relogins += 1
+
+    def start(self):
+        """
+        Log in all the sessions and start the keepalive thread.
+        """
+        self._closed.clear()
+        while len(self._clients) < self._size:
+            client = self._new_client()
+            self._clients.append(client)
+            self._idle.put(client)
+        if self._keepalive and self._thread is None:
+            self._thread = threading.Thread(
+                target=self._keepalive_loop, name="ftntlib-session-pool"
+            )
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _keepalive_loop(self):
+        while not self._closed.wait(self._keepalive):
+            self.refresh()
+
+    def refresh(self):
+        """
+        Check the idle sessions and log in again those which expired.
+
+        Checked out sessions are left alone, so in-flight work never sees a
+        session being renewed under its feet.
+        """
+        # One session out of the queue at a time, the others stay available
+        checked = set()
+        for _ in range(self._size):
+            try:
+                client = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                if id(client) in checked:
+                    # Back to the first session probed in this pass
+                    break
+                checked.add(id(client))
+                if status_code(client.get("sys/status")) != 0:
+                    try:
+                        self._relogin(client)
+                    except SessionPoolError as err:
+                        print("Session pool ERROR: ", err)
+            finally:
+                self._idle.put(client)
+
+    def acquire(self, timeout=None):
+        """
+        Take an idle session, waiting up to timeout seconds for one.
+        """
+        if self._closed.is_set():
+            raise SessionPoolError("Session pool is closed")
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise SessionPoolError("No idle session after {}s".format(timeout))
+
+    def release(self, client):
+        self._idle.put(client)
+
+    @contextlib.contextmanager
+    def checkout(self, timeout=None):
+        client = self.acquire(timeout)
+        try:
+            yield client
+        finally:
+            self.release(client)
+
+    def call(self, method, *args, **kwargs):
+        """
+        Run client.<method>(*args, **kwargs) on an idle session.
+
+        When the answer says the session expired, the session is logged in
+        again and the call is retried once.
+        """
+        with self.checkout() as client:
+            response = getattr(client, method)(*args, **kwargs)
+            if status_code(response) in self._relogin_codes:
+                self._relogin(client)
+                response = getattr(client, method)(*args, **kwargs)
+            return response
+
+    def close(self, timeout=None):
+        """
+        Stop the keepalive thread and log out all the sessions.
+
+        Checked out sessions are waited for, up to timeout seconds.
+        """
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for _ in self._clients:
+            try:
+                self._idle.get(timeout=timeout)
+            except queue.Empty:
+                break
+        for client in self._clients:
+            try:
+                client.logout()
+            except Exception as err:
+                print("Logout ERROR: ", err)
+            client.close()
+        self._clients = []
+        self._idle = queue.Queue()
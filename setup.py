@@ -7,6 +7,7 @@ setup(
       version='0.4.0.dev20',
       description='Python modules to interact with Fortinet products',
       install_requires=['requests','suds-jurko','lxml'],
+      extras_require={'async': ['aiohttp'], 'orjson': ['orjson'], 'arrow': ['pyarrow']},
       author='Original: Ashton Turpin, Maintainer: Jean-Pierre Forcioli, Contributors: Jeremy Parente',
       author_email='jpforcioli@fortinet.com, jparente@fortinet.com',
       url='https://fndn.fortinet.net',